@@ -0,0 +1,172 @@
+# Background e-mail alert dispatcher.
+#
+# The Dashboard only enqueues alerts; a worker thread drains the queue,
+# sends messages with the same credentials over one SMTP connection and
+# records budget alerts in sent_alerts so each (user, category, month)
+# is mailed at most once, across reruns and processes.
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+from email.mime.text import MIMEText
+
+import db
+
+log = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get("TRACKER_SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("TRACKER_SMTP_PORT", "465"))
+# Set TRACKER_SMTP_SSL=0 for a plain local sink (e.g. python -m smtpd / MailHog)
+SMTP_SSL = os.environ.get("TRACKER_SMTP_SSL", "1") != "0"
+SMTP_TIMEOUT = float(os.environ.get("TRACKER_SMTP_TIMEOUT", "20"))
+
+Alert = namedtuple("Alert", "sender password to subject body dedupe_key")
+Failure = namedtuple("Failure", "at to subject error")
+
+
+def _connect(host, port, use_ssl, sender, password):
+    cls = smtplib.SMTP_SSL if use_ssl else smtplib.SMTP
+    server = cls(host, port, timeout=SMTP_TIMEOUT)
+    if password:
+        server.login(sender, password)
+    return server
+
+
+def _message(alert):
+    msg = MIMEText(alert.body)
+    msg['Subject'] = alert.subject
+    msg['From'] = alert.sender
+    msg['To'] = alert.to
+    return msg
+
+
+def alerted_categories(conn, email, month):
+    # Categories already mailed for the month; the Dashboard skips queuing
+    # them, so viewing the page doesn't cost a write
+    return {r[0] for r in conn.execute("SELECT category FROM sent_alerts WHERE user_email = ? AND month = ?",
+                                       (email, month))}
+
+
+def send_now(sender, password, to, subject, body, host=None, port=None, use_ssl=None):
+    # Synchronous send (Settings "Send Test Email"); returns an error string or None
+    try:
+        with _connect(host or SMTP_HOST, port or SMTP_PORT, SMTP_SSL if use_ssl is None else use_ssl,
+                      sender, password) as server:
+            server.send_message(_message(Alert(sender, password, to, subject, body, None)))
+    except (smtplib.SMTPException, OSError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+class AlertDispatcher:
+    def __init__(self, host=None, port=None, use_ssl=None, db_path=None, batch_window=1.0):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.use_ssl = SMTP_SSL if use_ssl is None else use_ssl
+        self.db_path = db_path
+        self.batch_window = batch_window
+        self.failures = deque(maxlen=200)
+        self.sent = 0
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, sender, password, to, subject, body, dedupe_key=None):
+        # dedupe_key is (user_email, category, month); returns False if skipped
+        if dedupe_key is not None:
+            with self._lock:
+                if dedupe_key in self._pending:
+                    return False
+                self._pending.add(dedupe_key)
+        self._queue.put(Alert(sender, password, to, subject, body, dedupe_key))
+        return True
+
+    def pop_failures(self, to):
+        # Failures for one recipient, removed once reported
+        with self._lock:
+            mine = [f for f in self.failures if f.to == to]
+            for f in mine:
+                self.failures.remove(f)
+        return mine
+
+    def join(self):
+        self._queue.join()
+
+    # ── worker ──────────────────────────────────
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while (left := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self._queue.get(timeout=left))
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                log.exception("alert batch failed")
+                for alert in batch:
+                    self._fail(alert, f"{type(e).__name__}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.difference_update(a.dedupe_key for a in batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _claim(self, alert):
+        # Reserve the (user, category, month) slot; False if already mailed.
+        # sent_alerts lives in the user's shard (see db.py)
+        if alert.dedupe_key is None:
+            return True
+        with db.user_connection(alert.dedupe_key[0], self.db_path) as conn:
+            if conn.execute("SELECT 1 FROM sent_alerts WHERE user_email = ? AND category = ? AND month = ?",
+                            alert.dedupe_key).fetchone():
+                return False
+            cur = conn.execute("INSERT OR IGNORE INTO sent_alerts VALUES (?, ?, ?, ?)",
+                               alert.dedupe_key + (datetime.now().isoformat(),))
+            conn.commit()
+        return cur.rowcount == 1
+
+    def _release(self, alert):
+        if alert.dedupe_key is not None:
+            with db.user_connection(alert.dedupe_key[0], self.db_path) as conn:
+                conn.execute("DELETE FROM sent_alerts WHERE user_email = ? AND category = ? AND month = ?",
+                             alert.dedupe_key)
+                conn.commit()
+
+    def _fail(self, alert, error):
+        log.warning("alert to %s failed: %s", alert.to, error)
+        with self._lock:
+            self.failures.append(Failure(datetime.now(), alert.to, alert.subject, error))
+
+    def _send_batch(self, batch):
+        groups = {}
+        for alert in batch:
+            groups.setdefault((alert.sender, alert.password), []).append(alert)
+
+        for (sender, password), alerts in groups.items():
+            alerts = [a for a in alerts if self._claim(a)]
+            if not alerts:
+                continue
+            try:
+                server = _connect(self.host, self.port, self.use_ssl, sender, password)
+            except (smtplib.SMTPException, OSError) as e:
+                for alert in alerts:
+                    self._release(alert)
+                    self._fail(alert, f"{type(e).__name__}: {e}")
+                continue
+            with server:
+                for alert in alerts:
+                    try:
+                        server.send_message(_message(alert))
+                        self.sent += 1
+                    except (smtplib.SMTPException, OSError) as e:
+                        self._release(alert)
+                        self._fail(alert, f"{type(e).__name__}: {e}")
@@ -1,14 +1,18 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
-from datetime import datetime, date, timedelta
-import plotly.express as px
-from sklearn.linear_model import LinearRegression
-import numpy as np
-import smtplib
-from email.mime.text import MIMEText
-import bcrypt
+from datetime import datetime, date
 import os
+import profiler
+from auth import (SESSION_DAYS, HashPoolBusy, hash_password, make_token, rehash, revoke_sessions, token_user,
+                  verify_password)
+from cache import cached
+from db import get_conn, init_db, user_conn
+from jobs import start_scheduler
+from receipts import RECEIPTS_DIR
+from recurring import FREQUENCIES, next_occurrence
+
+# pandas, numpy, plotly, bcrypt and smtplib are imported by the pages that
+# need them, so a cold process serving the login form doesn't pay for them
+# (see "python manage.py startup-report")
 
 # Session State
 # ───────────────────────────────────────────────
@@ -24,111 +28,131 @@ if 'smtp_app_password' not in st.session_state:
     st.session_state.smtp_app_password = ""
 if 'currency' not in st.session_state:
     st.session_state.currency = "INR"
-if 'conv_rate' not in st.session_state:
-    st.session_state.conv_rate = 1.0
 
 CURRENCIES = {"INR": "₹", "USD": "$", "EUR": "€"}
-RECEIPTS_DIR = "receipts"
-os.makedirs(RECEIPTS_DIR, exist_ok=True)
+
+# Who sees the Diagnostics page (comma-separated emails)
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("TRACKER_ADMINS", "").split(",") if e.strip()}
 
 CATEGORIES = ["Food", "Transport", "Rent/Bills", "Entertainment", "Shopping", "Other"]
 INCOME_SOURCES = ["Salary", "Freelance", "Gift", "Other"]
 
 # ───────────────────────────────────────────────
-# Database - safe & complete
+# Database - pooled WAL connections (see db.py)
 # ───────────────────────────────────────────────
-def init_db():
-    conn = sqlite3.connect('tracker.db')
-    c = conn.cursor()
-
-    # Users
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        email TEXT PRIMARY KEY,
-        name TEXT,
-        password_hash TEXT
-    )''')
-
-    # Add 'name' column if missing (fixes old DB error)
-    c.execute("PRAGMA table_info(users)")
-    columns = [col[1] for col in c.fetchall()]
-    if 'name' not in columns:
-        c.execute("ALTER TABLE users ADD COLUMN name TEXT")
-        c.execute("UPDATE users SET name = 'User' WHERE name IS NULL")
-
-    # Expenses
-    c.execute('''CREATE TABLE IF NOT EXISTS expenses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_email TEXT,
-        date TEXT,
-        category TEXT,
-        amount REAL,
-        description TEXT,
-        receipt_path TEXT,
-        is_recurring INTEGER DEFAULT 0,
-        frequency TEXT,
-        next_date TEXT,
-        deleted_at TEXT
-    )''')
-
-    # Incomes
-    c.execute('''CREATE TABLE IF NOT EXISTS incomes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_email TEXT,
-        date TEXT,
-        source TEXT,
-        amount REAL,
-        description TEXT
-    )''')
-
-    # Category budgets
-    c.execute('''CREATE TABLE IF NOT EXISTS category_budgets (
-        month_year TEXT,
-        category TEXT,
-        amount REAL,
-        PRIMARY KEY (month_year, category)
-    )''')
+@st.cache_resource
+def bootstrap():
+    # Once per process, not per script run: schema migrations, receipts dir,
+    # and the background jobs (recurring entries, forecasts)
+    init_db()
+    os.makedirs(RECEIPTS_DIR, exist_ok=True)
+    return start_scheduler()
 
-    conn.commit()
-    conn.close()
 
-init_db()
+bootstrap()
 
 # ───────────────────────────────────────────────
 # Helpers
 # ───────────────────────────────────────────────
-def get_conn():
-    return sqlite3.connect('tracker.db')
-
 current_month = datetime.now().strftime("%Y-%m")
 
 def symbol():
     return CURRENCIES.get(st.session_state.currency, "₹")
 
-def convert(amt):
-    return amt * st.session_state.get('conv_rate', 1.0)
+def user_db():
+    # The signed-in user's shard; get_conn() is the catalog (users)
+    return user_conn(st.session_state.user_email)
+
+def cached_read(conn, key, loader):
+    # Served from memory until the user's data changes (see cache.py)
+    return cached(conn, st.session_state.user_email, key, loader)
+
+PAGE_SIZES = [25, 50, 100, 200]
+SORT_OPTIONS = {
+    "Newest first": ("date", True),
+    "Oldest first": ("date", False),
+    "Largest amount": ("amount_minor", True),
+    "Smallest amount": ("amount_minor", False),
+    "Best match (search)": ("rank", False),
+}
+
+def paged_entries(conn, table, key, **filters):
+    # Keyset-paginated listing with Prev/Next; only one page is ever loaded
+    from queries import entries_page
+    col_sort, col_size = st.columns(2)
+    sort_label = col_sort.selectbox("Sort by", list(SORT_OPTIONS), key=f"{key}_sort")
+    page_size = col_size.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_size")
+    sort, descending = SORT_OPTIONS[sort_label]
+
+    # Cursor of each visited page's start; back to page 1 when the query changes
+    signature = (sort_label, page_size, tuple(sorted(filters.items())))
+    pager = st.session_state.setdefault(f"{key}_pager", {"sig": None, "cursors": [None]})
+    if pager["sig"] != signature:
+        pager.update(sig=signature, cursors=[None])
+    after = pager["cursors"][-1]
+    df, next_cursor = cached_read(conn, (table, "page", signature, after), lambda: entries_page(
+        conn, table, st.session_state.user_email, sort=sort, descending=descending,
+        after=after, page_size=page_size, **filters))
+    # stored in minor units; shown in the entry's own currency
+    # (a new frame; the cached one is left as it was)
+    cols = [('amount' if c == 'amount_minor' else c) for c in df.columns]
+    df = df.assign(amount=df['amount_minor'] / 100)[cols]
+
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    if col_prev.button("◀ Prev", key=f"{key}_prev", disabled=len(pager["cursors"]) == 1):
+        pager["cursors"].pop()
+        st.rerun()
+    col_info.caption(f"Page {len(pager['cursors'])}")
+    if col_next.button("Next ▶", key=f"{key}_next", disabled=next_cursor is None):
+        pager["cursors"].append(next_cursor)
+        st.rerun()
+    return df
+
+def selectable_grid(df, key, editable=(), column_config=None):
+    # Table with a tick box per row -> (rows as edited, ids of ticked rows).
+    # The widget key follows the rows shown and a generation bumped by
+    # bulk_done, so ticks and edits never carry over to other rows.
+    gen = st.session_state.setdefault(f"{key}_gen", 0)
+    grid = df.copy()
+    if 'date' in editable:
+        # edited with a date picker; entry_changes turns them back into text
+        import pandas as pd
+        grid['date'] = pd.to_datetime(grid['date'], errors='coerce').dt.date
+    grid.insert(0, 'select', False)
+    edited = st.data_editor(
+        grid, key=f"{key}_grid_{gen}_{hash(tuple(df['id']))}", hide_index=True,
+        disabled=[c for c in grid.columns if c != 'select' and c not in editable],
+        column_config={"select": st.column_config.CheckboxColumn("✓"), **(column_config or {})})
+    return edited.drop(columns='select'), edited.loc[edited['select'], 'id'].tolist()
+
+def bulk_done(key, message):
+    st.session_state[f"{key}_gen"] += 1
+    st.toast(message)
+    st.rerun()
 
-def send_alert(subject, body):
+@st.cache_resource
+def get_dispatcher():
+    from alerts import AlertDispatcher
+    return AlertDispatcher()
+
+
+def send_alert(subject, body, dedupe_key=None):
+    # Queued for the background dispatcher; never blocks the page
     if not st.session_state.smtp_email or not st.session_state.smtp_app_password:
         return
-    try:
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = st.session_state.smtp_email
-        msg['To'] = st.session_state.user_email
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(st.session_state.smtp_email, st.session_state.smtp_app_password)
-            server.send_message(msg)
-    except:
-        pass
+    get_dispatcher().submit(st.session_state.smtp_email, st.session_state.smtp_app_password,
+                            st.session_state.user_email, subject, body, dedupe_key)
 
 # ───────────────────────────────────────────────
 # Auth
 # ───────────────────────────────────────────────
-def hash_pw(pw):
-    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
+# bcrypt runs on the shared hashing pool; see auth.py
+SESSION_COOKIE = "tracker_sid"
 
-def check_pw(pw, h):
-    return bcrypt.checkpw(pw.encode(), h.encode())
+def set_session_cookie(token, days=SESSION_DAYS):
+    # Written by the browser on the next run (see below). A cookie, not the
+    # URL: copied links, screenshots and history never carry the token.
+    st.session_state.session_cookie = (token, int(days * 86400))
 
 def signup(name, email, pw):
     email = email.lower().strip()
@@ -140,21 +164,31 @@ def signup(name, email, pw):
     if c.fetchone():
         conn.close()
         return False, "Email taken"
-    h = hash_pw(pw)
-    c.execute("INSERT INTO users VALUES (?, ?, ?)", (email, name, h))
+    try:
+        h = hash_password(pw)
+    except HashPoolBusy as e:
+        conn.close()
+        return False, str(e)
+    c.execute("INSERT INTO users (email, name, password_hash) VALUES (?, ?, ?)", (email, name, h))
     conn.commit()
     conn.close()
+    # signed straight in, so a reload keeps the session as after login
+    set_session_cookie(make_token(email, h))
     return True, "Account created"
 
 def login(email, pw):
     email = email.lower().strip()
     conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT password_hash, name FROM users WHERE email = ?", (email,))
+    c.execute("SELECT password_hash, name, session_gen FROM users WHERE email = ?", (email,))
     row = c.fetchone()
     conn.close()
-    if row and check_pw(pw, row[0]):
+    ok, needs_rehash = verify_password(pw, row[0]) if row else (False, False)
+    if ok:
+        h = rehash(email, pw, row[0]) if needs_rehash else row[0]
         st.session_state.user_name = row[1] or "User"
+        # a reload keeps the session without another bcrypt verify
+        set_session_cookie(make_token(email, h, row[2]))
         return True, email
     return False, None
 
@@ -168,13 +202,39 @@ def reset_password(email, new_pw):
     if not c.fetchone():
         conn.close()
         return False, "Email not found"
-    h = hash_pw(new_pw)
+    try:
+        h = hash_password(new_pw)
+    except HashPoolBusy as e:
+        conn.close()
+        return False, str(e)
     c.execute("UPDATE users SET password_hash = ? WHERE email = ?", (h, email))
     conn.commit()
     conn.close()
     return True, "Password reset successfully"
 
 
+# Signed session token from the cookie (set at login or signup), checked
+# once per browser session; links from before tokens moved out of the URL
+# no longer sign anyone in
+st.query_params.pop("sid", None)
+if st.session_state.user_email is None and not st.session_state.get("cookie_checked"):
+    st.session_state.cookie_checked = True
+    token = st.context.cookies.get(SESSION_COOKIE)
+    if token:
+        conn = get_conn()
+        user = token_user(conn, token)
+        conn.close()
+        if user:
+            st.session_state.user_email, st.session_state.user_name = user[0], user[1] or "User"
+        else:
+            set_session_cookie("", 0)
+
+if "session_cookie" in st.session_state:
+    token, max_age = st.session_state.pop("session_cookie")
+    secure = "; Secure" if (st.context.url or "").startswith("https") else ""
+    st.html(f"<script>document.cookie = '{SESSION_COOKIE}={token}; Max-Age={max_age}; Path=/; "
+            f"SameSite=Strict{secure}';</script>", unsafe_allow_javascript=True)
+
 # ───────────────────────────────────────────────
 # Login / Signup / Forgot Password
 # ───────────────────────────────────────────────
@@ -194,13 +254,17 @@ if st.session_state.user_email is None:
                 if not email or not pw:
                     st.error("Please fill both email and password")
                 else:
-                    ok, user = login(email, pw)
-                    if ok:
-                        st.session_state.user_email = user
-                        st.success("Login successful! Redirecting...")
-                        st.rerun()
+                    try:
+                        ok, user = login(email, pw)
+                    except HashPoolBusy as e:
+                        st.warning(str(e))
                     else:
-                        st.error("Invalid email or password. Try again.")
+                        if ok:
+                            st.session_state.user_email = user
+                            st.success("Login successful! Redirecting...")
+                            st.rerun()
+                        else:
+                            st.error("Invalid email or password. Try again.")
 
     with tab2:
         with st.form("signup_form", clear_on_submit=True):
@@ -262,162 +326,157 @@ st.sidebar.markdown(f"**Welcome, {st.session_state.user_name or 'User'}** 👤")
 st.sidebar.markdown(f"({st.session_state.user_email})")
 
 # Sidebar with beautiful emojis
-page = st.sidebar.radio("Go to", [
+page = st.sidebar.radio("Go to", key="page", options=[
     "Dashboard",
     "Your Income",
     "Your Expenses",
     "Set Budgets",
+    "Import Statement",
     "Manage Entries",
     "Trash",
     "Charts",
     "Prediction",
     "Settings"
-])
+] + (["Diagnostics"] if st.session_state.user_email in ADMIN_EMAILS else []))
+
+# Timings, SQL and cache hits of this rerun (see profiler.py)
+profiler.start_run(page, st.session_state.user_email)
 
 if st.sidebar.button(" Logout"):
+    # also signs out any other tab or device holding a session cookie
+    revoke_sessions(st.session_state.user_email)
     st.session_state.user_email = None
     st.session_state.user_name = ""
+    set_session_cookie("", 0)
     st.rerun()
 
 # ───────────────────────────────────────────────
 # Dashboard - with best category display format
 # ───────────────────────────────────────────────
 if page == "Dashboard":
-    st.title(f"Welcome back, {st.session_state.user_name or 'User'}! ")
-    # Auto-process recurring transactions (runs every time Dashboard opens)
-    today = date.today().isoformat()
-    conn = get_conn()
-    c = conn.cursor()
-
-    # Expenses recurring
-    c.execute("SELECT * FROM expenses WHERE user_email = ? AND is_recurring = 1 AND next_date <= ? AND deleted_at IS NULL",
-              (st.session_state.user_email, today))
-    exp_rows = c.fetchall()
-
-    for row in exp_rows:
-        # Create new entry for this month
-        c.execute("""
-            INSERT INTO expenses (user_email, date, category, amount, description, receipt_path, is_recurring, frequency, next_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (st.session_state.user_email, today, row[3], row[4], row[5], row[6], 1, "Monthly",
-              (datetime.fromisoformat(row[9]) + timedelta(days=30)).isoformat()))
-
-    # Incomes recurring (if you added recurring to income table)
-    c.execute("SELECT * FROM incomes WHERE user_email = ? AND is_recurring = 1 AND next_date <= ?",
-              (st.session_state.user_email, today))
-    inc_rows = c.fetchall()
-
-    for row in inc_rows:
-        c.execute("""
-            INSERT INTO incomes (user_email, date, source, amount, description, is_recurring, frequency, next_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (st.session_state.user_email, today, row[3], row[4], row[5], 1, "Monthly",
-              (datetime.fromisoformat(row[8]) + timedelta(days=30)).isoformat()))
-
-    if exp_rows or inc_rows:
-        conn.commit()
-        st.toast(f"Auto-added {len(exp_rows)} recurring expenses & {len(inc_rows)} incomes! ")
-
-    conn.close()
-
-    conn = get_conn()
-    exp_total = pd.read_sql_query(
-        "SELECT SUM(amount) as s FROM expenses WHERE user_email = ? AND deleted_at IS NULL",
-        conn, params=(st.session_state.user_email,)
-    )['s'].iloc[0] or 0
-
-    inc_total = pd.read_sql_query(
-        "SELECT SUM(amount) as s FROM incomes WHERE user_email = ?",
-        conn, params=(st.session_state.user_email,)
-    )['s'].iloc[0] or 0
+    import numpy as np
+    from queries import budget_progress, dashboard_totals
 
+    st.title(f"Welcome back, {st.session_state.user_name or 'User'}! ")
+    conn = user_db()
+    inc_total, exp_total = cached_read(conn, ("dashboard_totals", st.session_state.currency),
+                                       lambda: dashboard_totals(conn, st.session_state.user_email,
+                                                                st.session_state.currency))
     conn.close()
 
     savings = inc_total - exp_total
 
     cols = st.columns(3)
-    cols[0].metric("Income", f"{symbol()}{convert(inc_total):,.2f}")
-    cols[1].metric("Expenses", f"{symbol()}{convert(exp_total):,.2f}")
-    cols[2].metric("Savings", f"{symbol()}{convert(savings):,.2f}")
+    cols[0].metric("Income", f"{symbol()}{inc_total:,.2f}")
+    cols[1].metric("Expenses", f"{symbol()}{exp_total:,.2f}")
+    cols[2].metric("Savings", f"{symbol()}{savings:,.2f}")
 
     # ───────────────────────────────────────────────
     # Category Budget Progress - BEST format you wanted
     # ───────────────────────────────────────────────
     st.subheader("Category Budget Progress")
-
-    conn = get_conn()
-    budgets = pd.read_sql_query(
-        "SELECT category, amount FROM category_budgets WHERE month_year = ?",
-        conn, params=(current_month,)
-    )
+    profiler.section("Dashboard: budgets")
+
+    conn = user_db()
+    budgets = cached_read(conn, ("budget_progress", current_month, st.session_state.currency),
+                          lambda: budget_progress(conn, st.session_state.user_email, current_month,
+                                                  st.session_state.currency))
+    alerted = set()
+    if not budgets.empty and (budgets['remaining'] < 0).any() and st.session_state.smtp_email:
+        from alerts import alerted_categories
+        alerted = alerted_categories(conn, st.session_state.user_email, current_month)
     conn.close()
 
     if budgets.empty:
         st.info("No budgets set yet. Go to ' Set Budgets' to add some!")
     else:
-        for _, b in budgets.iterrows():
-            cat = b['category']
-            budget = b['amount'] or 0
-            spent = pd.read_sql_query(
-                "SELECT SUM(amount) as s FROM expenses WHERE user_email = ? AND category = ? AND deleted_at IS NULL AND strftime('%Y-%m', date) = ?",
-                get_conn(), params=(st.session_state.user_email, cat, current_month)
-            )['s'].iloc[0] or 0
-
-            remaining = budget - spent
-            percentage_used = (spent / budget * 100) if budget > 0 else 0
-            percentage_under = 100 - percentage_used if budget > 0 else 0
-
-            # Status text & color
-            if budget == 0:
-                status = "No budget set"
-                color = "grey"
-            elif percentage_used > 100:
-                status = f"{abs(percentage_under):.0f}% **over** budget "
-                color = "error"
-            elif percentage_used > 80:
-                status = f"{percentage_under:.0f}% under budget (warning zone)"
-                color = "warning"
-            else:
-                status = f"{percentage_under:.0f}% under budget "
-                color = "success"
+        # Status text for every category at once
+        under = budgets['pct_under'].round().astype(int).astype(str)
+        budgets['status'] = np.select(
+            [budgets['level'] == "none", budgets['level'] == "over", budgets['level'] == "warning"],
+            ["No budget set",
+             budgets['pct_under'].abs().round().astype(int).astype(str) + "% **over** budget ",
+             under + "% under budget (warning zone)"],
+            default=under + "% under budget ",
+        )
+        budgets['prog_value'] = (budgets['pct_used'] / 100).clip(upper=1.0)
+
+        for b in budgets.itertuples(index=False):
+            cat, budget, spent, remaining = b.category, b.budget, b.spent, b.remaining
 
             # Beautiful display
             st.markdown(f"**{cat}**")
-            st.caption(f"Spent: {symbol()}{convert(spent):,.0f} of {symbol()}{convert(budget):,.0f} budget")
-            st.caption(f"**{status}**")
+            st.caption(f"Spent: {symbol()}{spent:,.0f} of {symbol()}{budget:,.0f} budget")
+            st.caption(f"**{b.status}**")
 
             # Progress bar (shows how much used)
-            prog_value = min(percentage_used / 100, 1.0)
-            st.progress(prog_value, text=f"{percentage_used:.0f}% used")
+            st.progress(b.prog_value, text=f"{b.pct_used:.0f}% used")
 
             # Remaining or over
             if remaining > 0:
-                st.success(f"Remaining: {symbol()}{convert(remaining):,.0f} ")
+                st.success(f"Remaining: {symbol()}{remaining:,.0f} ")
             elif remaining < 0:
-                st.error(f"Over by: {symbol()}{convert(-remaining):,.0f}  ️")
-                send_alert("Budget Alert", f"{cat}: over by {symbol()}{convert(-remaining):,.2f}")
+                st.error(f"Over by: {symbol()}{-remaining:,.0f}  ️")
+                if cat not in alerted:
+                    send_alert("Budget Alert", f"{cat}: over by {symbol()}{-remaining:,.2f}",
+                               (st.session_state.user_email, cat, current_month))
             else:
                 st.warning("Budget fully used")
 
             st.markdown("---")  # nice separator line
 
+    for failure in get_dispatcher().pop_failures(st.session_state.user_email):
+        st.warning(f"Could not send alert '{failure.subject}': {failure.error}")
+
 # ───────────────────────────────────────────────
 # Set Budgets
 # ───────────────────────────────────────────────
 elif page == "Set Budgets":
+    from budgets import budget_changes, budget_grid, copy_budgets, month_budgets, save_budgets
     st.title("Set Category Budgets")
     month_date = st.date_input("Month", value=date.today().replace(day=1))
     month = month_date.strftime("%Y-%m")
+    last_month = f"{month_date.year - (month_date.month == 1)}-{(month_date.month - 2) % 12 + 1:02d}"
 
-    for cat in CATEGORIES:
-        amt = st.number_input(f"Budget for {cat} ({symbol()})", min_value=0.0, step=500.0, value=0.0)
-        if st.button(f"Save {cat}"):
-            conn = get_conn()
-            c = conn.cursor()
-            c.execute("INSERT OR REPLACE INTO category_budgets VALUES (?, ?, ?)", (month, cat, amt))
-            conn.commit()
+    if st.button(f"Copy budgets from {last_month}",
+                 help="Sets this month's budget for every category budgeted last month"):
+        conn = user_db()
+        copied = copy_budgets(conn, st.session_state.user_email, last_month, month)
+        conn.close()
+        if copied:
+            st.success(f"Copied {copied} budget(s) from {last_month}")
+        else:
+            st.info(f"No budgets set for {last_month}")
+
+    conn = user_db()
+    stored = month_budgets(conn, st.session_state.user_email, month)
+    conn.close()
+
+    # Edits stay in the form until Save; only changed rows are written.
+    # The key follows the stored values so a save or copy reloads the grid.
+    with st.form("budget_form"):
+        st.caption("Leave an amount blank for no budget")
+        edited = st.data_editor(
+            budget_grid(stored, CATEGORIES, st.session_state.currency),
+            key=f"budget_grid_{month}_{hash(tuple(stored.itertuples(index=False)))}",
+            hide_index=True,
+            disabled=["category"],
+            column_config={
+                "category": st.column_config.TextColumn("Category"),
+                "amount": st.column_config.NumberColumn("Budget", min_value=0.0, step=500.0, format="%.2f"),
+                "currency": st.column_config.SelectboxColumn("Currency", options=list(CURRENCIES), required=True),
+            },
+        )
+        submitted = st.form_submit_button("Save Budgets")
+    if submitted:
+        changes = budget_changes(stored, edited)
+        if changes:
+            conn = user_db()
+            save_budgets(conn, st.session_state.user_email, month, changes)
             conn.close()
-            st.success(f"Budget for {cat} saved for {month}")
+            st.success(f"Saved {len(changes)} budget change(s) for {month}")
+        else:
+            st.info("No changes to save")
 
 # ───────────────────────────────────────────────
 # Your Expenses
@@ -426,13 +485,14 @@ elif page == "Your Expenses":
     st.title("Add New Expense")
     d = st.date_input("Date", date.today())
     cat = st.selectbox("Category", CATEGORIES)
-    amt = st.number_input("Amount", min_value=0.0, step=1.0)
+    col_amt, col_cur = st.columns([3, 1])
+    amt = col_amt.number_input("Amount", min_value=0.0, step=1.0)
+    entry_cur = col_cur.selectbox("Currency", list(CURRENCIES), index=list(CURRENCIES).index(st.session_state.currency))
     desc = st.text_input("Description")
-    rec = st.checkbox("Repeat every month? (recurring) ")
-    if rec:
-        st.info("This expense will auto-repeat every month")
     rec = st.checkbox("Mark as Recurring?")
-    freq = st.selectbox("Frequency", ["Monthly", "Weekly"]) if rec else None
+    freq = st.selectbox("Frequency", FREQUENCIES) if rec else None
+    if rec:
+        st.info(f"This expense will auto-repeat ({freq.lower()})")
     receipt = st.file_uploader("Receipt (optional)", type=["jpg", "png"])
 
     if st.button("Add Expense"):
@@ -441,25 +501,21 @@ elif page == "Your Expenses":
         else:
             path = None
             if receipt:
-                path = os.path.join(RECEIPTS_DIR, f"{st.session_state.user_email}_{receipt.name}")
-                with open(path, "wb") as f:
-                    f.write(receipt.getvalue())
+                from receipts import store_receipt
+                path = store_receipt(receipt, receipt.name)
 
-            next_date = None
-            if rec:
-                # Next month same date
-                next_d = datetime.combine(d, datetime.min.time()) + timedelta(days=30)
-                next_date = next_d.isoformat()
+            from money import to_minor
+            next_date = next_occurrence(d, freq).isoformat() if rec else None
 
-            conn = get_conn()
+            conn = user_db()
             c = conn.cursor()
             c.execute("""
-                INSERT INTO expenses (user_email, date, category, amount, description, receipt_path, is_recurring, frequency, next_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (st.session_state.user_email, d.isoformat(), cat, amt, desc, path, 1 if rec else 0, "Monthly" if rec else None, next_date))
+                INSERT INTO expenses (user_email, date, category, amount_minor, currency, description, receipt_path, is_recurring, frequency, next_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (st.session_state.user_email, d.isoformat(), cat, to_minor(amt), entry_cur, desc, path, 1 if rec else 0, freq, next_date))
             conn.commit()
             conn.close()
-            st.success("Expense added!" + (" (will repeat monthly )" if rec else ""))
+            st.success("Expense added!" + (f" (will repeat {freq.lower()} )" if rec else ""))
 
 # ───────────────────────────────────────────────
 # Your Income
@@ -468,7 +524,9 @@ elif page == "Your Income":
     st.title("Add New Income")
     d = st.date_input("Date", date.today())
     src = st.selectbox("Source", INCOME_SOURCES)
-    amt = st.number_input("Amount", min_value=0.0, step=1.0)
+    col_amt, col_cur = st.columns([3, 1])
+    amt = col_amt.number_input("Amount", min_value=0.0, step=1.0)
+    entry_cur = col_cur.selectbox("Currency", list(CURRENCIES), index=list(CURRENCIES).index(st.session_state.currency))
     desc = st.text_input("Description")
     rec = st.checkbox("Repeat monthly? (recurring) ")
     if rec:
@@ -478,25 +536,95 @@ elif page == "Your Income":
         if amt <= 0:
             st.error("Amount must be > 0")
         else:
-            next_date = None
-            if rec:
-                next_d = datetime.combine(d, datetime.min.time()) + timedelta(days=30)
-                next_date = next_d.isoformat()
+            from money import to_minor
+            next_date = next_occurrence(d, "Monthly").isoformat() if rec else None
 
-            conn = get_conn()
+            conn = user_db()
             c = conn.cursor()
             c.execute("""
-                INSERT INTO incomes (user_email, date, source, amount, description, is_recurring, frequency, next_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (st.session_state.user_email, d.isoformat(), src, amt, desc, 1 if rec else 0, "Monthly" if rec else None, next_date))
+                INSERT INTO incomes (user_email, date, source, amount_minor, currency, description, is_recurring, frequency, next_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (st.session_state.user_email, d.isoformat(), src, to_minor(amt), entry_cur, desc, 1 if rec else 0, "Monthly" if rec else None, next_date))
             conn.commit()
             conn.close()
             st.success("Income added!" + (" (will repeat monthly )" if rec else ""))
 
+# ───────────────────────────────────────────────
+# Import Statement
+# ───────────────────────────────────────────────
+elif page == "Import Statement":
+    import pandas as pd
+    from importer import (DEFAULT_EXPENSE_RULES, DEFAULT_INCOME_RULES, format_rules, import_statement,
+                          parse_rules, parse_statement)
+
+    st.title("Import Bank / Card Statement")
+    st.caption("Upload a CSV export. Negative amounts (or debits) become expenses, positive ones incomes. "
+               "Lines already imported are skipped, so re-uploading a statement is safe.")
+    upload = st.file_uploader("Statement (CSV)", type=["csv"])
+
+    if upload:
+        raw = pd.read_csv(upload, dtype=str)
+        st.dataframe(raw.head(10))
+        cols = list(raw.columns)
+
+        def guess(*names):
+            for i, col in enumerate(cols):
+                if any(n in col.lower() for n in names):
+                    return i
+            return 0
+
+        col_a, col_b = st.columns(2)
+        date_col = col_a.selectbox("Date column", cols, index=guess("date"))
+        desc_col = col_b.selectbox("Description column", cols, index=guess("desc", "narration", "detail", "memo"))
+        mode = st.radio("Amounts", ["One signed amount column", "Separate debit / credit columns"], horizontal=True)
+        amount_col = debit_col = credit_col = None
+        negative_is_expense = True
+        if mode == "One signed amount column":
+            amount_col = st.selectbox("Amount column", cols, index=guess("amount"))
+            negative_is_expense = st.checkbox("Negative amounts are expenses", value=True)
+        else:
+            col_d, col_c = st.columns(2)
+            debit_col = col_d.selectbox("Debit column", cols, index=guess("debit", "withdraw"))
+            credit_col = col_c.selectbox("Credit column", cols, index=guess("credit", "deposit"))
+        dayfirst = st.checkbox("Dates are day-first (31/01/2025)", value=True)
+        statement_cur = st.selectbox("Statement currency", list(CURRENCIES),
+                                     index=list(CURRENCIES).index(st.session_state.currency))
+
+        with st.expander("Category rules (pattern = Category, first match wins)"):
+            exp_rules = st.text_area("Expense rules", format_rules(DEFAULT_EXPENSE_RULES), height=150)
+            inc_rules = st.text_area("Income rules", format_rules(DEFAULT_INCOME_RULES), height=100)
+        # checked as edited; nothing is parsed or imported until every pattern compiles
+        rules = {}
+        for label, text in [("Expense", exp_rules), ("Income", inc_rules)]:
+            try:
+                rules[label] = parse_rules(text)
+            except ValueError as e:
+                st.error(f"{label} rules: {e}")
+        if len(rules) == 2:
+            parsed = parse_statement(raw, date_col, desc_col, amount_col, debit_col, credit_col,
+                                     dayfirst=dayfirst, negative_is_expense=negative_is_expense,
+                                     expense_rules=rules["Expense"], income_rules=rules["Income"])
+            st.caption(f"{len(parsed)} of {len(raw)} lines parsed")
+            st.dataframe(parsed.drop(columns=["import_hash", "amount_minor"]).head(20))
+
+            if st.button("Import", disabled=parsed.empty):
+                bar = st.progress(0.0, text="Importing...")
+                conn = user_db()
+                try:
+                    result = import_statement(conn, st.session_state.user_email, parsed, currency=statement_cur,
+                                              progress=lambda done, total: bar.progress(done / total, text=f"{done:,}/{total:,} rows"))
+                finally:
+                    conn.close()
+                st.success(f"Imported {result['expenses']:,} expenses and {result['incomes']:,} incomes "
+                           f"({result['duplicates']:,} duplicates skipped) in {result['seconds']:.2f}s "
+                           f"- {result['rows_per_sec']:,.0f} rows/sec")
+
 # ───────────────────────────────────────────────
 # Manage Entries
 # ───────────────────────────────────────────────
 elif page == "Manage Entries":
+    from entries import EDITABLE, delete_incomes, entry_changes, move_to_trash, set_label, update_entries
+
     st.title("Manage Entries")
 
     tab1, tab2 = st.tabs(["Expenses", "Incomes"])
@@ -505,206 +633,252 @@ elif page == "Manage Entries":
         search = st.text_input(" Search description")
         from_d = st.date_input("From", date.today().replace(day=1))
         to_d = st.date_input("To", date.today())
+        filters = dict(search=search or None, from_d=from_d and from_d.isoformat(), to_d=to_d and to_d.isoformat())
 
-        conn = get_conn()
-        q = "SELECT id, date, category, amount, description, receipt_path FROM expenses WHERE user_email = ? AND deleted_at IS NULL"
-        p = [st.session_state.user_email]
-        if search:
-            q += " AND description LIKE ?"
-            p.append(f"%{search}%")
-        if from_d:
-            q += " AND date >= ?"
-            p.append(from_d.isoformat())
-        if to_d:
-            q += " AND date <= ?"
-            p.append(to_d.isoformat())
-        df = pd.read_sql_query(q, conn, params=p)
-        conn.close()
+        conn = user_db()
+        df = paged_entries(conn, "expenses", "exp", **filters)
 
         if not df.empty:
-            st.dataframe(df[['id','date','category','amount','description']])
-            csv = df.to_csv(index=False).encode()
-            st.download_button(" Export Expenses CSV", csv, "expenses.csv", "text/csv")
-
-            eid = st.number_input("ID to Edit/Delete", step=1)
-            row = df[df['id'] == eid]
-            if not row.empty:
-                row = row.iloc[0]
-                new_d = st.date_input("New Date", pd.to_datetime(row['date']))
-                new_cat = st.selectbox("New Category", CATEGORIES, index=CATEGORIES.index(row['category']))
-                new_amt = st.number_input("New Amount", value=float(row['amount']), min_value=0.01)
-                new_desc = st.text_input("New Description", value=row['description'] or "")
-
-                col_a, col_b = st.columns(2)
-                with col_a:
-                    if st.button("️ Update"):
-                        conn = get_conn()
-                        c = conn.cursor()
-                        c.execute("UPDATE expenses SET date=?, category=?, amount=?, description=? WHERE id=?",
-                                  (new_d.isoformat(), new_cat, new_amt, new_desc, eid))
-                        conn.commit()
-                        conn.close()
-                        st.success("Expense updated")
-
-                with col_b:
-                    if st.button("🗑 Delete"):
-                        conn = get_conn()
-                        c = conn.cursor()
-                        c.execute("UPDATE expenses SET deleted_at = ? WHERE id = ?", (datetime.now().isoformat(), eid))
-                        conn.commit()
-                        conn.close()
-                        st.success("Moved to trash")
-
-                if row['receipt_path'] and os.path.exists(row['receipt_path']):
-                    st.subheader("Receipt Preview")
-                    st.image(row['receipt_path'], width=400)
+            # Edit cells in place or tick rows for the bulk actions below
+            edited, selected = selectable_grid(
+                df[['id', 'date', 'category', 'amount', 'currency', 'description']], "exp",
+                editable=EDITABLE["expenses"], column_config={
+                    "date": st.column_config.DateColumn("date", format="YYYY-MM-DD", required=True),
+                    "category": st.column_config.SelectboxColumn("category", options=CATEGORIES, required=True),
+                    "amount": st.column_config.NumberColumn("amount", min_value=0.01, format="%.2f"),
+                })
+            try:
+                changes = entry_changes("expenses", df, edited)
+            except ValueError as e:
+                st.error(str(e))
+                changes = []
+
+            col_save, col_cat, col_set, col_del = st.columns([1, 1, 1, 1])
+            if col_save.button(f"Save edits ({len(changes)})", disabled=not changes):
+                update_entries(conn, "expenses", st.session_state.user_email, changes)
+                conn.close()
+                bulk_done("exp", f"{len(changes)} expense(s) updated")
+            bulk_cat = col_cat.selectbox("Category for selected", CATEGORIES, label_visibility="collapsed")
+            if col_set.button(f"Set category ({len(selected)})", disabled=not selected):
+                n = set_label(conn, "expenses", st.session_state.user_email, selected, bulk_cat)
+                conn.close()
+                bulk_done("exp", f"{n} expense(s) moved to {bulk_cat}")
+            if col_del.button(f"🗑 Move to trash ({len(selected)})", disabled=not selected):
+                n = move_to_trash(conn, st.session_state.user_email, selected)
+                conn.close()
+                bulk_done("exp", f"{n} expense(s) moved to trash")
+
+            receipt = df.loc[df['id'].isin(selected), 'receipt_path'].dropna()
+            if len(selected) == 1 and len(receipt) and os.path.exists(receipt.iloc[0]):
+                from receipts import thumbnail
+                st.subheader("Receipt Preview")
+                full_size = st.checkbox("Show full size", key="receipt_full")
+                st.image(receipt.iloc[0] if full_size else thumbnail(receipt.iloc[0]), width=400)
         else:
             st.info("No expenses match the filter")
+        conn.close()
 
     with tab2:
+        profiler.section("Manage Entries: incomes")
         search_inc = st.text_input(" Search description/source")
-        conn = get_conn()
-        q_inc = "SELECT id, date, source, amount, description FROM incomes WHERE user_email = ?"
-        p_inc = [st.session_state.user_email]
-        if search_inc:
-            q_inc += " AND (description LIKE ? OR source LIKE ?)"
-            p_inc.extend([f"%{search_inc}%", f"%{search_inc}%"])
-        df_inc = pd.read_sql_query(q_inc, conn, params=p_inc)
-        conn.close()
+        from_inc = st.date_input("From", None, key="inc_from")
+        to_inc = st.date_input("To", date.today(), key="inc_to")
+        filters_inc = dict(search=search_inc or None, from_d=from_inc and from_inc.isoformat(),
+                           to_d=to_inc and to_inc.isoformat())
+
+        conn = user_db()
+        df_inc = paged_entries(conn, "incomes", "inc", **filters_inc)
 
         if not df_inc.empty:
-            st.dataframe(df_inc)
-            csv_inc = df_inc.to_csv(index=False).encode()
-            st.download_button(" Export Incomes CSV", csv_inc, "incomes.csv", "text/csv")
-
-            iid = st.number_input("ID to Edit/Delete (Income)", step=1)
-            row_inc = df_inc[df_inc['id'] == iid]
-            if not row_inc.empty:
-                row_inc = row_inc.iloc[0]
-                new_d = st.date_input("New Date", pd.to_datetime(row_inc['date']))
-                new_src = st.selectbox("New Source", INCOME_SOURCES, index=INCOME_SOURCES.index(row_inc['source']))
-                new_amt = st.number_input("New Amount", value=float(row_inc['amount']), min_value=0.01)
-                new_desc = st.text_input("New Description", value=row_inc['description'] or "")
-
-                col_a, col_b = st.columns(2)
-                with col_a:
-                    if st.button("️ Update Income"):
-                        conn = get_conn()
-                        c = conn.cursor()
-                        c.execute("UPDATE incomes SET date=?, source=?, amount=?, description=? WHERE id=?",
-                                  (new_d.isoformat(), new_src, new_amt, new_desc, iid))
-                        conn.commit()
-                        conn.close()
-                        st.success("Income updated")
-
-                with col_b:
-                    if st.button("️ Delete Income"):
-                        conn = get_conn()
-                        c = conn.cursor()
-                        c.execute("DELETE FROM incomes WHERE id = ?", (iid,))
-                        conn.commit()
-                        conn.close()
-                        st.success("Income deleted")
+            edited_inc, selected_inc = selectable_grid(
+                df_inc, "inc", editable=EDITABLE["incomes"], column_config={
+                    "date": st.column_config.DateColumn("date", format="YYYY-MM-DD", required=True),
+                    "source": st.column_config.SelectboxColumn("source", options=INCOME_SOURCES, required=True),
+                    "amount": st.column_config.NumberColumn("amount", min_value=0.01, format="%.2f"),
+                })
+            try:
+                changes_inc = entry_changes("incomes", df_inc, edited_inc)
+            except ValueError as e:
+                st.error(str(e))
+                changes_inc = []
+
+            col_save, col_src, col_set, col_del = st.columns([1, 1, 1, 1])
+            if col_save.button(f"Save edits ({len(changes_inc)})", disabled=not changes_inc, key="inc_save"):
+                update_entries(conn, "incomes", st.session_state.user_email, changes_inc)
+                conn.close()
+                bulk_done("inc", f"{len(changes_inc)} income(s) updated")
+            bulk_src = col_src.selectbox("Source for selected", INCOME_SOURCES, label_visibility="collapsed")
+            if col_set.button(f"Set source ({len(selected_inc)})", disabled=not selected_inc):
+                n = set_label(conn, "incomes", st.session_state.user_email, selected_inc, bulk_src)
+                conn.close()
+                bulk_done("inc", f"{n} income(s) moved to {bulk_src}")
+            if col_del.button(f"️ Delete ({len(selected_inc)})", disabled=not selected_inc, key="inc_delete"):
+                n = delete_incomes(conn, st.session_state.user_email, selected_inc)
+                conn.close()
+                bulk_done("inc", f"{n} income(s) deleted")
         else:
             st.info("No incomes match the filter")
+        conn.close()
+
+    # Export: built only when asked for, streamed from the database in chunks
+    profiler.section("Manage Entries: export")
+    st.subheader("Export")
+    col_t, col_r, col_f = st.columns(3)
+    exp_table = col_t.selectbox("Data", ["Expenses", "Incomes"], key="export_table")
+    exp_range = col_r.selectbox("Range", ["Date range", "All history"], key="export_range")
+    exp_format = col_f.selectbox("Format", ["CSV", "Parquet"], key="export_format")
+    if exp_range == "Date range":
+        col_from, col_to = st.columns(2)
+        exp_from = col_from.date_input("Export from", date.today().replace(day=1), key="export_from")
+        exp_to = col_to.date_input("Export to", date.today(), key="export_to")
+    else:
+        exp_from = exp_to = None
+
+    if st.button("Prepare export"):
+        from export import new_export_file, write_csv, write_parquet
+        table = exp_table.lower()
+        ext = "csv" if exp_format == "CSV" else "parquet"
+        old_export = st.session_state.get("export_file")
+        if old_export and os.path.exists(old_export["path"]):
+            os.remove(old_export["path"])
+        path = new_export_file(ext)
+        conn = user_db()
+        try:
+            args = (conn, table, st.session_state.user_email)
+            kwargs = dict(from_d=exp_from and exp_from.isoformat(), to_d=exp_to and exp_to.isoformat())
+            if ext == "csv":
+                with open(path, "wb") as f:
+                    write_csv(*args, f, **kwargs)
+            else:
+                write_parquet(*args, path, **kwargs)
+            st.session_state.export_file = {"path": path, "name": f"{table}.{ext}",
+                                            "mime": "text/csv" if ext == "csv" else "application/vnd.apache.parquet"}
+        except RuntimeError as e:
+            os.remove(path)
+            st.session_state.export_file = None
+            st.error(str(e))
+        finally:
+            conn.close()
+
+    # the file is only read when the button is clicked
+    export_file = st.session_state.get("export_file")
+    if export_file and os.path.exists(export_file["path"]):
+        from export import reader
+        st.download_button(f" Download {export_file['name']}", reader(export_file["path"]),
+                           export_file["name"], export_file["mime"], on_click="ignore")
+    elif export_file:
+        st.session_state.export_file = None
 
 # ───────────────────────────────────────────────
 # Trash
 # ───────────────────────────────────────────────
 elif page == "Trash":
+    from entries import restore_entries
+    from queries import trash_entries
+    from retention import TRASH_RETENTION_DAYS, delete_trashed
+
     st.title("Trash (Deleted Expenses)")
-    st.caption("Items you deleted from expenses appear here. You can restore or permanently delete them.")
+    st.caption("Items you deleted from expenses appear here. You can restore or permanently delete them. "
+               f"Trash older than {TRASH_RETENTION_DAYS:g} days is deleted automatically.")
 
-    conn = get_conn()
-    df = pd.read_sql_query(
-        "SELECT id, date, category, amount, description FROM expenses WHERE user_email = ? AND deleted_at IS NOT NULL ORDER BY deleted_at DESC",
-        conn, params=(st.session_state.user_email,)
-    )
+    conn = user_db()
+    df = cached_read(conn, "trash", lambda: trash_entries(conn, st.session_state.user_email))
     conn.close()
 
     if df.empty:
         st.info("Trash is empty. Delete some expenses from 'Manage Entries' to see them here.")
     else:
-        st.dataframe(df)
-        tid = st.number_input("Enter ID to restore or delete", step=1, min_value=0)
-
-        if tid in df['id'].values:
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("Restore", key=f"restore_{tid}"):
-                    conn = get_conn()
-                    c = conn.cursor()
-                    c.execute("UPDATE expenses SET deleted_at = NULL WHERE id = ?", (tid,))
-                    conn.commit()
-                    conn.close()
-                    st.success(f"Item {tid} restored!")
-                    st.rerun()
-
-            with col2:
-                if st.button("Permanent Delete", key=f"perm_delete_{tid}"):
-                    conn = get_conn()
-                    c = conn.cursor()
-                    c.execute("DELETE FROM expenses WHERE id = ?", (tid,))
-                    conn.commit()
-                    conn.close()
-                    st.success(f"Item {tid} deleted forever!")
-                    st.rerun()
-        else:
-            if tid > 0:
-                st.warning(f"ID {tid} not found in trash")
+        _, selected = selectable_grid(df, "trash")
+        col1, col2, col3 = st.columns(3)
+        if col1.button(f"Restore ({len(selected)})", disabled=not selected):
+            conn = user_db()
+            n = restore_entries(conn, st.session_state.user_email, selected)
+            conn.close()
+            bulk_done("trash", f"{n} item(s) restored")
+        if col2.button(f"Permanent Delete ({len(selected)})", disabled=not selected):
+            conn = user_db()
+            n = delete_trashed(conn, st.session_state.user_email, selected)
+            conn.close()
+            bulk_done("trash", f"{n} item(s) deleted forever")
+        if col3.button(f"Empty trash ({len(df)} items)"):
+            conn = user_db()
+            n = delete_trashed(conn, st.session_state.user_email, df['id'].tolist())
+            conn.close()
+            bulk_done("trash", f"{n} item(s) deleted forever")
 # ───────────────────────────────────────────────
 # Charts
 # ───────────────────────────────────────────────
 elif page == "Charts":
+    import plotly.express as px
+    from charts import CHART_WINDOWS, downsample, window_start
+    from queries import expenses_by_category, expenses_by_day, expenses_by_month
+
     st.title("Charts & Trends ")
-    conn = get_conn()
-    df = pd.read_sql_query("SELECT date, category, amount FROM expenses WHERE user_email = ? AND deleted_at IS NULL", conn, params=(st.session_state.user_email,))
+    window = st.selectbox("Time window", list(CHART_WINDOWS), index=1)
+    since = window_start(date.today(), CHART_WINDOWS[window])
+    since_month = since.strftime("%Y-%m") if since else None
+
+    # Aggregated in SQL (rollups / GROUP BY date); only chart points come back
+    conn = user_db()
+    cur = st.session_state.currency
+    by_cat = cached_read(conn, ("by_category", since_month, cur),
+                         lambda: expenses_by_category(conn, st.session_state.user_email, since_month, cur))
+    monthly = cached_read(conn, ("by_month", since_month, cur),
+                          lambda: expenses_by_month(conn, st.session_state.user_email, since_month, cur))
+    daily = cached_read(conn, ("by_day", since_month, cur),
+                        lambda: expenses_by_day(conn, st.session_state.user_email, since and since.isoformat(), cur))
     conn.close()
-    if df.empty:
+    profiler.section("Charts: plots")
+    if by_cat.empty:
         st.info("No expenses yet to show charts")
     else:
-        df['date'] = pd.to_datetime(df['date'])
         st.subheader("Expense by Category (Pie)")
-        fig_pie = px.pie(df, values='amount', names='category')
+        fig_pie = px.pie(by_cat, values='amount', names='category')
         st.plotly_chart(fig_pie, use_container_width=True)
         st.subheader("Monthly Trend (Bar)")
-        df['month'] = df['date'].dt.strftime('%Y-%m')
-        monthly = df.groupby('month')['amount'].sum().reset_index()
         fig_bar = px.bar(monthly, x='month', y='amount')
         st.plotly_chart(fig_bar, use_container_width=True)
         st.subheader("Daily Spending Trend (Line)")
-        daily = df.groupby('date')['amount'].sum().reset_index()
-        fig_line = px.line(daily, x='date', y='amount')
+        points = downsample(daily, 'date', 'amount')
+        if len(points) < len(daily):
+            st.caption(f"Showing {len(points)} of {len(daily)} days (downsampled)")
+        fig_line = px.line(points, x='date', y='amount')
         st.plotly_chart(fig_line, use_container_width=True)
 
 # ───────────────────────────────────────────────
 # Prediction
 # ───────────────────────────────────────────────
 elif page == "Prediction":
+    from forecast import TOTAL, forecast_stamp, user_forecast
+
     st.title("Next Month Expense Prediction")
-    conn = get_conn()
-    df = pd.read_sql_query("SELECT date, amount FROM expenses WHERE user_email = ? AND deleted_at IS NULL", conn, params=(st.session_state.user_email,))
+    conn = user_db()
+    # the refresh job doesn't bump the data version, so the stored
+    # forecast's own stamp is part of the key
+    stamp = tuple(forecast_stamp(conn, st.session_state.user_email))
+    fc = cached_read(conn, ("forecast", current_month, st.session_state.currency) + stamp,
+                     lambda: user_forecast(conn, st.session_state.user_email, date.today(),
+                                           st.session_state.currency))
     conn.close()
-    if len(df) < 3:
+    total = fc[(fc['category'] == TOTAL) & fc['amount'].notna()]
+    if total.empty:
         st.info("Need at least 3 months of data for prediction")
     else:
-        df['date'] = pd.to_datetime(df['date'])
-        df['month'] = df['date'].dt.to_period('M')
-        monthly = df.groupby('month')['amount'].sum().reset_index()
-        monthly['num'] = range(len(monthly))
-        if len(monthly) >= 3:
-            X = monthly[['num']]
-            y = monthly['amount']
-            model = LinearRegression().fit(X, y)
-            pred = model.predict([[len(monthly)]])[0]
-            st.success(f"Predicted next month expense: {symbol()}{max(0, pred):,.2f}")
-        else:
-            st.info("Need more months for better prediction")
+        st.success(f"Predicted next month expense: {symbol()}{total['amount'].iloc[0]:,.2f}")
+        by_cat = fc[(fc['category'] != TOTAL) & fc['amount'].notna()]
+        if not by_cat.empty:
+            st.subheader(f"By category ({total['month'].iloc[0]})")
+            st.dataframe(by_cat[['category', 'amount']].rename(columns={'amount': 'predicted'}),
+                         hide_index=True)
 
 # ───────────────────────────────────────────────
 # Settings
 # ───────────────────────────────────────────────
 elif page == "Settings":
+    import pandas as pd
+    from alerts import send_now
+    from money import BASE_CURRENCY, save_rate_everywhere
+
     st.title("Settings")
 
     # Theme
@@ -723,12 +897,25 @@ elif page == "Settings":
         st.session_state.currency = cur
         st.success(f"Currency changed to {cur}")
 
-    # Conversion Rate
-    st.subheader("Conversion Rate")
-    rate = st.number_input("Rate (1 base = X display)", min_value=0.01, value=st.session_state.conv_rate, step=0.01)
-    if st.button("Apply Rate"):
-        st.session_state.conv_rate = rate
-        st.success("Conversion rate updated!")
+    # Exchange rates: dated, shared by all users; every amount is converted
+    # at the rate in force on its own date
+    st.subheader("Exchange Rates")
+    conn = user_db()
+    rates = pd.read_sql_query(
+        "SELECT currency, rate_date, rate FROM fx_rates ORDER BY currency, rate_date DESC", conn)
+    if rates.empty:
+        st.caption(f"No rates yet; other currencies count 1:1 with {BASE_CURRENCY}")
+    else:
+        st.dataframe(rates, hide_index=True)
+    col_c, col_d, col_r = st.columns(3)
+    rate_cur = col_c.selectbox("Currency", [c for c in CURRENCIES if c != BASE_CURRENCY], key="rate_cur")
+    rate_date = col_d.date_input("From date", date.today(), key="rate_date")
+    rate = col_r.number_input(f"1 {rate_cur} = ? {BASE_CURRENCY}", min_value=0.0001, value=1.0,
+                              step=0.01, format="%.4f", key="rate_value")
+    if st.button("Save Rate"):
+        save_rate_everywhere(rate_cur, rate_date.isoformat(), rate)
+        st.success(f"{rate_cur} rate from {rate_date} saved")
+    conn.close()
 
     # Email Alerts
     st.subheader("Email Alerts (for over-budget)")
@@ -745,10 +932,48 @@ elif page == "Settings":
     with col2:
         if st.button("Send Test Email"):
             if st.session_state.smtp_email and st.session_state.smtp_app_password:
-                send_alert("Test Alert", "This is a test message from your tracker!")
-                st.success("Test email sent! Check your inbox/spam.")
+                err = send_now(st.session_state.smtp_email, st.session_state.smtp_app_password,
+                               st.session_state.user_email, "Test Alert", "This is a test message from your tracker!")
+                if err:
+                    st.error(f"Test email failed: {err}")
+                else:
+                    st.success("Test email sent! Check your inbox/spam.")
             else:
                 st.error("Please save Gmail and App Password first")
 
+# ───────────────────────────────────────────────
+# Diagnostics (admins only)
+# ───────────────────────────────────────────────
+elif page == "Diagnostics" and st.session_state.user_email in ADMIN_EMAILS:
+    import pandas as pd
+    from cache import query_cache
+
+    st.title("Diagnostics")
+    st.caption(f"Last {len(profiler.runs)} reruns of this server process")
+
+    hits, misses = profiler.cache_stats()
+    cols = st.columns(3)
+    cols[0].metric("Query cache hit rate", f"{hits / (hits + misses):.0%}" if hits + misses else "-")
+    cols[1].metric("Cached results", len(query_cache))
+    cols[2].metric("Slow query threshold", f"{profiler.SLOW_QUERY_MS:.0f} ms")
+
+    st.subheader("Page render time (ms)")
+    st.dataframe(profiler.page_stats().round(1), hide_index=True)
+    with st.expander("By section"):
+        st.dataframe(profiler.section_stats().round(1), hide_index=True)
+
+    st.subheader("SQL statements (ms)")
+    st.dataframe(profiler.query_stats().round(2), hide_index=True)
+
+    st.subheader("Slow queries")
+    slow = pd.DataFrame(list(profiler.slow_queries), columns=["at", "page", "user", "ms", "rows", "sql"])
+    if slow.empty:
+        st.info("None so far")
+    else:
+        slow['at'] = pd.to_datetime(slow['at'], unit='s')
+        st.dataframe(slow.iloc[::-1].round(1), hide_index=True)
+
+profiler.finish_run()
+
 # Clean footer
 st.sidebar.caption("")
\ No newline at end of file
@@ -0,0 +1,180 @@
+# Password hashing and session tokens.
+#
+# bcrypt runs on a small shared worker pool instead of the Streamlit script
+# thread, so a burst of logins can't take every core; bcrypt releases the
+# GIL, so other sessions keep rendering meanwhile. Hashes made with fewer
+# (or more) rounds than TRACKER_BCRYPT_ROUNDS are redone on the next
+# successful login, the only time the plain password is at hand.
+#
+# A signed session token (kept in a browser cookie by app.py) lets a reload
+# skip the bcrypt verify: it carries the email, an expiry and a fingerprint
+# of the current password hash and the user's session generation, so
+# resetting the password or logging out revokes it.
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import db
+
+BCRYPT_ROUNDS = int(os.environ.get("TRACKER_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.environ.get("TRACKER_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Requests waiting beyond this get "busy, try again" instead of queueing forever
+HASH_QUEUE = int(os.environ.get("TRACKER_HASH_QUEUE", "64"))
+HASH_TIMEOUT = float(os.environ.get("TRACKER_HASH_TIMEOUT", "30"))
+
+SESSION_DAYS = float(os.environ.get("TRACKER_SESSION_DAYS", "7"))
+# Without a configured secret, tokens only survive until the process restarts
+SESSION_SECRET = os.environ.get("TRACKER_SESSION_SECRET", "").encode() or secrets.token_bytes(32)
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+_pool = None
+_slots = threading.BoundedSemaphore(HASH_QUEUE)
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _pool
+
+
+def _submit(fn, *args):
+    if not _slots.acquire(timeout=HASH_TIMEOUT):
+        raise HashPoolBusy("Too many sign-ins at once, please try again")
+    try:
+        future = _executor().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+# ───────────────────────────────────────────────
+# Hashing (runs on the pool)
+# ───────────────────────────────────────────────
+def _hash(pw, rounds):
+    import bcrypt
+    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(pw, h):
+    import bcrypt
+    try:
+        return bcrypt.checkpw(pw.encode(), h.encode())
+    except ValueError:
+        # empty or malformed hash (e.g. seeded users)
+        return False
+
+
+def hash_rounds(h):
+    # '$2b$12$...' -> 12
+    try:
+        return int(h.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _wait(future):
+    # A queue too long to clear in time reads as "busy" to the caller
+    try:
+        return future.result(HASH_TIMEOUT)
+    except FutureTimeout:
+        raise HashPoolBusy("Sign-in is taking too long, please try again") from None
+
+
+def hash_password(pw, rounds=None):
+    return _wait(_submit(_hash, pw, rounds or BCRYPT_ROUNDS))
+
+
+def verify_password(pw, h):
+    # -> (ok, needs_rehash)
+    ok = bool(h) and _wait(_submit(_check, pw, h))
+    return ok, ok and hash_rounds(h) != BCRYPT_ROUNDS
+
+
+def rehash(email, pw, old_hash, path=None):
+    # Store a hash at the current cost; returns the hash now on file. The
+    # session token is issued for it, so this finishes before login does.
+    try:
+        new_hash = hash_password(pw)
+    except HashPoolBusy:
+        return old_hash   # try again next login
+    with db.connection(path) as conn:
+        # only if the password didn't change in the meantime
+        cur = conn.execute("UPDATE users SET password_hash = ? WHERE email = ? AND password_hash = ?",
+                           (new_hash, email, old_hash))
+        conn.commit()
+    return new_hash if cur.rowcount else old_hash
+
+
+# ───────────────────────────────────────────────
+# Session tokens
+# ───────────────────────────────────────────────
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _fingerprint(password_hash, generation):
+    return hashlib.sha256(f"{password_hash or ''}|{generation}".encode()).hexdigest()[:16]
+
+
+def _sign(payload):
+    return hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest()
+
+
+def make_token(email, password_hash, generation=0, days=SESSION_DAYS, now=None):
+    expires = int((now or time.time()) + days * 86400)
+    payload = f"{email}|{expires}|{_fingerprint(password_hash, generation)}".encode()
+    return f"{_b64(payload)}.{_b64(_sign(payload))}"
+
+
+def read_token(token, now=None):
+    # -> (email, fingerprint) of a well-signed, unexpired token, else None
+    try:
+        payload_b64, sig_b64 = token.split(".")
+        payload = _unb64(payload_b64)
+        if not hmac.compare_digest(_unb64(sig_b64), _sign(payload)):
+            return None
+        email, expires, fingerprint = payload.decode().rsplit("|", 2)
+        if int(expires) < (now or time.time()):
+            return None
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return email, fingerprint
+
+
+def token_user(conn, token):
+    # -> (email, name) if the token is valid for the user's current password
+    # and session generation
+    claims = read_token(token)
+    if claims is None:
+        return None
+    email, fingerprint = claims
+    row = conn.execute("SELECT password_hash, name, session_gen FROM users WHERE email = ?", (email,)).fetchone()
+    if row is None or not hmac.compare_digest(_fingerprint(row[0], row[2]), fingerprint):
+        return None
+    return email, row[1]
+
+
+def revoke_sessions(email, path=None):
+    # Logout: every token issued so far for this user stops working
+    with db.connection(path) as conn:
+        conn.execute("UPDATE users SET session_gen = session_gen + 1 WHERE email = ?", (email,))
+        conn.commit()
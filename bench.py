@@ -0,0 +1,166 @@
+# Benchmark of each page's data path.
+#
+# Calls the same functions the pages use (queries.py, forecast.py) straight
+# against the database - no Streamlit, no query cache - for a sample of
+# users, and reports latency percentiles and peak Python memory per page.
+#   python manage.py seed --users 2000
+#   python manage.py bench --budget-ms 50
+#   python manage.py bench-login --clients 32
+import threading
+import time
+import tracemalloc
+from datetime import date
+
+import numpy as np
+
+import auth
+import db
+import forecast
+import queries
+
+BENCH_SEARCH = "uber"
+
+
+def _dashboard(conn, email, ctx):
+    queries.dashboard_totals(conn, email, ctx["currency"])
+    queries.budget_progress(conn, email, ctx["month"], ctx["currency"])
+
+
+def _charts(conn, email, ctx):
+    queries.expenses_by_category(conn, email, ctx["since_month"], ctx["currency"])
+    queries.expenses_by_month(conn, email, ctx["since_month"], ctx["currency"])
+    queries.expenses_by_day(conn, email, ctx["since"], ctx["currency"])
+
+
+def _prediction(conn, email, ctx):
+    forecast.user_forecast(conn, email, ctx["today"], ctx["currency"])
+
+
+def _manage_entries(conn, email, ctx):
+    queries.entries_page(conn, "expenses", email, from_d=ctx["month_start"], to_d=ctx["today"].isoformat())
+    queries.entries_page(conn, "incomes", email, to_d=ctx["today"].isoformat())
+
+
+def _search(conn, email, ctx):
+    queries.entries_page(conn, "expenses", email, search=BENCH_SEARCH, sort="rank")
+    queries.entries_page(conn, "expenses", email, search=BENCH_SEARCH, sort="amount_minor")
+
+
+def _trash(conn, email, ctx):
+    queries.trash_entries(conn, email)
+
+
+PAGES = {
+    "Dashboard": _dashboard,
+    "Charts": _charts,
+    "Prediction": _prediction,
+    "Manage Entries": _manage_entries,
+    "Search": _search,
+    "Trash": _trash,
+}
+
+
+def sample_users(conn, n, seed=0):
+    emails = [r[0] for r in conn.execute("SELECT email FROM users ORDER BY email")]
+    if len(emails) <= n:
+        return emails
+    rng = np.random.default_rng(seed)
+    return sorted(rng.choice(emails, n, replace=False).tolist())
+
+
+def run(emails, repeat=5, pages=None, today=None, currency="INR", path=None):
+    # -> [{page, calls, p50, p95, p99, max (ms), peak_kb}]
+    # one connection per shard, each user's calls go to their own
+    conns = {p: db.get_conn(p) for p in db.shard_paths(path)}
+    try:
+        users = [(conns[db.shard_path(e, path)], e) for e in emails]
+        return _run(users, repeat, pages, today, currency)
+    finally:
+        for conn in conns.values():
+            conn.close()
+
+
+def _run(users, repeat, pages, today, currency):
+    today = today or date.today()
+    since = date(today.year - 1, today.month, 1)
+    ctx = {
+        "today": today,
+        "currency": currency,
+        "month": today.strftime("%Y-%m"),
+        "month_start": today.replace(day=1).isoformat(),
+        "since": since.isoformat(),
+        "since_month": since.strftime("%Y-%m"),
+    }
+    results = []
+    for name in pages or PAGES:
+        fn = PAGES[name]
+        # first call per user warms the page cache and any lazily built rows
+        for conn, email in users:
+            fn(conn, email, ctx)
+        times = []
+        for _ in range(repeat):
+            for conn, email in users:
+                t0 = time.perf_counter()
+                fn(conn, email, ctx)
+                times.append((time.perf_counter() - t0) * 1000)
+        # memory is traced in a separate pass; tracing slows the calls down
+        peak = 0
+        for conn, email in users:
+            tracemalloc.start()
+            fn(conn, email, ctx)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+        results.append({"page": name, "calls": len(times), "p50": p50, "p95": p95, "p99": p99,
+                        "max": max(times), "peak_kb": peak / 1024})
+    return results
+
+
+# ───────────────────────────────────────────────
+# Login throughput
+# ───────────────────────────────────────────────
+def _clients(n_clients, per_client, fn):
+    # n_clients threads each calling fn() per_client times -> (seconds, latencies ms)
+    times = []
+    lock = threading.Lock()
+    start = threading.Barrier(n_clients + 1)
+
+    def client():
+        start.wait()
+        mine = []
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            fn()
+            mine.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            times.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(n_clients)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, times
+
+
+def run_login(clients=16, per_client=4, rounds=None):
+    # Concurrent logins three ways: bcrypt on each session's own thread (the
+    # old behaviour), through the bounded hashing pool, and a reload with a
+    # session token. -> [{mode, logins, seconds, per_sec, p50, p95}]
+    password = "correct horse"
+    h = auth._hash(password, rounds or auth.BCRYPT_ROUNDS)
+    token = auth.make_token("bench@example.com", h)
+    modes = {
+        "bcrypt inline": lambda: auth._check(password, h),
+        f"bcrypt pool ({auth.HASH_WORKERS} workers)": lambda: auth.verify_password(password, h),
+        "session token": lambda: auth.read_token(token),
+    }
+    results = []
+    for mode, fn in modes.items():
+        seconds, times = _clients(clients, per_client, fn)
+        p50, p95 = np.percentile(times, [50, 95])
+        results.append({"mode": mode, "logins": len(times), "seconds": seconds,
+                        "per_sec": len(times) / seconds, "p50": p50, "p95": p95})
+    return results
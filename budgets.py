@@ -0,0 +1,75 @@
+# Category budgets for one month, edited as a grid.
+#
+# The Set Budgets page loads a month's budgets with one query, lets the user
+# edit every category at once, and saves only the cells that changed in a
+# single transaction. A blank amount removes that category's budget.
+import pandas as pd
+
+from money import MINOR_PER_UNIT, to_minor
+
+_UPSERT = """INSERT INTO category_budgets (user_email, month_year, category, amount_minor, currency)
+             {source}
+             ON CONFLICT (user_email, month_year, category)
+             DO UPDATE SET amount_minor = excluded.amount_minor, currency = excluded.currency"""
+
+
+def month_budgets(conn, email, month):
+    # -> DataFrame category, amount_minor, currency as stored
+    return pd.read_sql_query(
+        "SELECT category, amount_minor, currency FROM category_budgets "
+        "WHERE user_email = ? AND month_year = ? ORDER BY category", conn, params=(email, month))
+
+
+def budget_grid(stored, categories, currency):
+    # One row per category, plus any stored category no longer offered;
+    # amounts in major units, blank where no budget is set
+    extra = [c for c in stored['category'] if c not in categories]
+    grid = pd.DataFrame({'category': list(categories) + extra}).merge(stored, on='category', how='left')
+    grid['amount'] = grid['amount_minor'] / MINOR_PER_UNIT
+    grid['currency'] = grid['currency'].fillna(currency)
+    return grid[['category', 'amount', 'currency']]
+
+
+def budget_changes(stored, edited):
+    # -> [(category, amount_minor or None to remove, currency)] for rows that differ
+    old = {r.category: (r.amount_minor, r.currency) for r in stored.itertuples(index=False)}
+    changes = []
+    for r in edited.itertuples(index=False):
+        if pd.isna(r.amount):
+            if r.category in old:
+                changes.append((r.category, None, None))
+        elif old.get(r.category) != (to_minor(r.amount), r.currency):
+            changes.append((r.category, to_minor(r.amount), r.currency))
+    return changes
+
+
+def save_budgets(conn, email, month, changes):
+    # Apply budget_changes() in one transaction; returns the number applied
+    upserts = [(email, month, cat, minor, cur) for cat, minor, cur in changes if minor is not None]
+    removed = [(email, month, cat) for cat, minor, _ in changes if minor is None]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(_UPSERT.format(source="VALUES (?, ?, ?, ?, ?)"), upserts)
+        conn.executemany("DELETE FROM category_budgets WHERE user_email = ? AND month_year = ? AND category = ?",
+                         removed)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(upserts) + len(removed)
+
+
+def copy_budgets(conn, email, from_month, to_month):
+    # Every budget of from_month into to_month, replacing the amounts there;
+    # categories without a budget in from_month keep theirs. -> rows copied
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # WHERE keeps ON CONFLICT from being parsed as part of the SELECT
+        cur = conn.execute(_UPSERT.format(
+            source="SELECT user_email, ?, category, amount_minor, currency FROM category_budgets "
+                   "WHERE user_email = ? AND month_year = ?"), (to_month, email, from_month))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cur.rowcount
@@ -0,0 +1,81 @@
+# In-memory cache for per-user query results.
+#
+# Entries are keyed by (user, data version, query key). The data version is
+# bumped by triggers on every write to the user's rows (see db.py), so a
+# cached result is served until something actually changes. Results are
+# converted between currencies at read time, so the shared '*' version
+# (bumped when exchange rates change) is part of every user's version.
+import os
+import threading
+from collections import OrderedDict
+
+import profiler
+
+CACHE_MAX_ENTRIES = int(os.environ.get("TRACKER_CACHE_ENTRIES", "512"))
+
+
+def data_version(conn, email):
+    row = conn.execute("""
+        SELECT (SELECT version FROM data_versions WHERE user_email = ?),
+               (SELECT version FROM data_versions WHERE user_email = '*')
+    """, (email,)).fetchone()
+    return (row[0] or 0, row[1] or 0)
+
+
+class QueryCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, email, version, key, loader):
+        full_key = (email, version, key)
+        with self._lock:
+            if full_key in self._entries:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                profiler.count_cache(True)
+                return _copy(self._entries[full_key])
+            self.misses += 1
+        profiler.count_cache(False)
+
+        value = loader()
+
+        with self._lock:
+            seen = self._versions.get(email)
+            if seen is None or version > seen:
+                # the user's older results can never be hit again
+                self._versions[email] = version
+                for stale in [k for k in self._entries if k[0] == email and k[1] < version]:
+                    del self._entries[stale]
+            self._entries[full_key] = value
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return _copy(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+def _copy(value):
+    # DataFrames get mutated by page code (e.g. df['date'] = ...); hand out
+    # copies, also of frames inside tuples such as (page, cursor)
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    return value.copy() if hasattr(value, "copy") else value
+
+
+query_cache = QueryCache()
+
+
+def cached(conn, email, key, loader):
+    return query_cache.get(email, data_version(conn, email), key, loader)
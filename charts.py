@@ -0,0 +1,48 @@
+# Chart helpers: keep the payload sent to the browser roughly constant no
+# matter how much history a user has.
+import numpy as np
+
+MAX_CHART_POINTS = 500
+
+# label -> months of history (None = everything)
+CHART_WINDOWS = {"Last 3 months": 3, "Last 12 months": 12, "Last 3 years": 36, "All time": None}
+
+
+def window_start(today, months):
+    # First day of the month `months - 1` months before today's month
+    if months is None:
+        return None
+    y, m = divmod(today.year * 12 + today.month - 1 - (months - 1), 12)
+    return today.replace(year=y, month=m + 1, day=1)
+
+
+def lttb(x, y, threshold=MAX_CHART_POINTS):
+    # Largest-Triangle-Three-Buckets: indices of `threshold` points that keep
+    # the visual shape of the series (peaks and dips survive)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    every = (n - 2) / (threshold - 2)
+    idx = np.empty(threshold, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        nxt_hi = min(int((i + 2) * every) + 1, n)
+        avg_x = x[hi:nxt_hi].mean()
+        avg_y = y[hi:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def downsample(df, x_col, y_col, threshold=MAX_CHART_POINTS):
+    if len(df) <= threshold:
+        return df
+    x = df[x_col].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return df.iloc[lttb(x, df[y_col].to_numpy(), threshold)]
@@ -0,0 +1,728 @@
+import hashlib
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+from profiler import PROFILE_ENABLED, ProfiledCursor
+
+DB_PATH = os.environ.get("TRACKER_DB", "tracker.db")
+
+# Connection tuning (per connection, applied when a pooled connection is opened)
+BUSY_TIMEOUT_MS = int(os.environ.get("TRACKER_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.environ.get("TRACKER_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.environ.get("TRACKER_MMAP_SIZE", str(128 * 1024 * 1024)))
+POOL_SIZE = int(os.environ.get("TRACKER_POOL_SIZE", "8"))
+
+# Per-user data is spread over this many files; 1 keeps everything in DB_PATH
+SHARD_COUNT = int(os.environ.get("TRACKER_SHARDS", "1"))
+
+
+# ───────────────────────────────────────────────
+# Connection pool
+# ───────────────────────────────────────────────
+class PooledConnection(sqlite3.Connection):
+    # close() hands the connection back to its pool instead of closing the
+    # file, so the usual "conn = get_conn() ... conn.close()" pattern is cheap.
+    # Like a real close, anything left uncommitted is rolled back.
+    pool = None
+    checked_out = False
+
+    # Every statement goes through a cursor that reports to the profiler
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = ProfiledCursor if PROFILE_ENABLED else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if not self.checked_out:
+            return
+        self.checked_out = False
+        if self.in_transaction:
+            self.rollback()
+        if self.pool is None or not self.pool.release(self):
+            sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               factory=PooledConnection, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        # NORMAL is durable enough in WAL mode and skips an fsync per commit
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+            return True
+        except queue.Full:
+            return False
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            sqlite3.Connection.close(conn)
+
+
+_pools = {}
+
+
+def get_pool(path=None):
+    path = path or DB_PATH
+    pool = _pools.get(path)
+    if pool is None:
+        pool = _pools.setdefault(path, ConnectionPool(path))
+    return pool
+
+
+def get_conn(path=None):
+    return get_pool(path).acquire()
+
+
+@contextmanager
+def connection(path=None):
+    conn = get_conn(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# ───────────────────────────────────────────────
+# Shard routing
+# ───────────────────────────────────────────────
+# DB_PATH is the catalog: users and sign-in live there only. Each user's
+# entries, budgets, rollups, alerts and forecasts live in one shard file,
+# picked by a hash of the email, so writers for different users take
+# different file locks. fx_rates is global and kept in every file (see
+# save_rate_everywhere) so conversions run against the user's shard alone.
+# With one shard the catalog is the shard, as before sharding existed.
+def shard_paths(path=None, count=None):
+    path = path or DB_PATH
+    count = count or SHARD_COUNT
+    if count == 1:
+        return [path]
+    stem, ext = os.path.splitext(path)
+    # the count is part of the name, so resharding writes fresh files
+    return [f"{stem}.shard{i:02d}-of-{count:02d}{ext}" for i in range(count)]
+
+
+def shard_index(email, count=None):
+    # stable across processes and restarts, unlike hash()
+    count = count or SHARD_COUNT
+    digest = hashlib.blake2b((email or "").encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_path(email, path=None, count=None):
+    return shard_paths(path, count)[shard_index(email, count)]
+
+
+def all_paths(path=None, count=None):
+    # catalog first, then every shard
+    path = path or DB_PATH
+    return [path] + [p for p in shard_paths(path, count) if p != path]
+
+
+def user_conn(email, path=None):
+    return get_conn(shard_path(email, path))
+
+
+@contextmanager
+def user_connection(email, path=None):
+    conn = user_conn(email, path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# ───────────────────────────────────────────────
+# Schema migrations (tracked in PRAGMA user_version)
+# ───────────────────────────────────────────────
+def _m001_base_schema(c):
+    # Users
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+        email TEXT PRIMARY KEY,
+        name TEXT,
+        password_hash TEXT
+    )''')
+
+    # Add 'name' column if missing (fixes old DB error)
+    c.execute("PRAGMA table_info(users)")
+    columns = [col[1] for col in c.fetchall()]
+    if 'name' not in columns:
+        c.execute("ALTER TABLE users ADD COLUMN name TEXT")
+        c.execute("UPDATE users SET name = 'User' WHERE name IS NULL")
+
+    # Expenses
+    c.execute('''CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_email TEXT,
+        date TEXT,
+        category TEXT,
+        amount REAL,
+        description TEXT,
+        receipt_path TEXT,
+        is_recurring INTEGER DEFAULT 0,
+        frequency TEXT,
+        next_date TEXT,
+        deleted_at TEXT
+    )''')
+
+    # Incomes
+    c.execute('''CREATE TABLE IF NOT EXISTS incomes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_email TEXT,
+        date TEXT,
+        source TEXT,
+        amount REAL,
+        description TEXT
+    )''')
+
+    # Category budgets
+    c.execute('''CREATE TABLE IF NOT EXISTS category_budgets (
+        month_year TEXT,
+        category TEXT,
+        amount REAL,
+        PRIMARY KEY (month_year, category)
+    )''')
+
+
+def _m002_query_indexes(c):
+    # 'YYYY-MM' bucket derived from the ISO date, so month filters become
+    # index range scans instead of strftime() on every row
+    for table in ("expenses", "incomes"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN month TEXT "
+                  "GENERATED ALWAYS AS (substr(date, 1, 7)) VIRTUAL")
+
+    # Live expenses: listings/date ranges, and per-month category sums
+    c.execute("""CREATE INDEX idx_expenses_user_date ON expenses
+                 (user_email, date, category, amount) WHERE deleted_at IS NULL""")
+    c.execute("""CREATE INDEX idx_expenses_user_month ON expenses
+                 (user_email, month, category, amount) WHERE deleted_at IS NULL""")
+    # Trash
+    c.execute("""CREATE INDEX idx_expenses_user_deleted ON expenses
+                 (user_email, deleted_at) WHERE deleted_at IS NOT NULL""")
+
+    c.execute("CREATE INDEX idx_incomes_user_date ON incomes (user_email, date, source, amount)")
+    c.execute("CREATE INDEX idx_incomes_user_month ON incomes (user_email, month, source, amount)")
+
+
+def _m003_user_budgets(c):
+    # Budgets were global; scope them per user. Every existing user keeps
+    # seeing the budgets they saw before.
+    c.execute('''CREATE TABLE category_budgets_new (
+        user_email TEXT NOT NULL,
+        month_year TEXT NOT NULL,
+        category TEXT NOT NULL,
+        amount REAL,
+        PRIMARY KEY (user_email, month_year, category)
+    )''')
+    c.execute("""INSERT INTO category_budgets_new (user_email, month_year, category, amount)
+                 SELECT u.email, b.month_year, b.category, b.amount
+                 FROM category_budgets b CROSS JOIN users u""")
+    c.execute("DROP TABLE category_budgets")
+    c.execute("ALTER TABLE category_budgets_new RENAME TO category_budgets")
+
+
+def _m004_monthly_rollups(c):
+    # (user, month, category) -> sum/count of live rows, kept current by
+    # triggers so dashboards and charts never rescan raw history
+    c.execute('''CREATE TABLE expense_rollup (
+        user_email TEXT NOT NULL,
+        month TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        n INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_email, month, category)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE income_rollup (
+        user_email TEXT NOT NULL,
+        month TEXT NOT NULL,
+        source TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        n INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_email, month, source)
+    ) WITHOUT ROWID''')
+
+    # Expenses: soft-deleted rows (deleted_at set) don't count, so trashing
+    # and restoring are just updates that move a row out of / into the rollup
+    c.execute("""CREATE TRIGGER trg_expenses_rollup_insert AFTER INSERT ON expenses
+        WHEN NEW.deleted_at IS NULL
+        BEGIN
+            INSERT INTO expense_rollup
+            VALUES (IFNULL(NEW.user_email, ''), IFNULL(NEW.month, ''), IFNULL(NEW.category, ''), IFNULL(NEW.amount, 0), 1)
+            ON CONFLICT DO UPDATE SET total = total + excluded.total, n = n + 1;
+        END""")
+    c.execute("""CREATE TRIGGER trg_expenses_rollup_delete AFTER DELETE ON expenses
+        WHEN OLD.deleted_at IS NULL
+        BEGIN
+            UPDATE expense_rollup SET total = total - IFNULL(OLD.amount, 0), n = n - 1
+            WHERE user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND category = IFNULL(OLD.category, '');
+            DELETE FROM expense_rollup
+            WHERE n <= 0 AND user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND category = IFNULL(OLD.category, '');
+        END""")
+    c.execute("""CREATE TRIGGER trg_expenses_rollup_update
+        AFTER UPDATE OF user_email, date, category, amount, deleted_at ON expenses
+        BEGIN
+            UPDATE expense_rollup SET total = total - IFNULL(OLD.amount, 0), n = n - 1
+            WHERE OLD.deleted_at IS NULL AND user_email = IFNULL(OLD.user_email, '')
+              AND month = IFNULL(OLD.month, '') AND category = IFNULL(OLD.category, '');
+            DELETE FROM expense_rollup
+            WHERE n <= 0 AND user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND category = IFNULL(OLD.category, '');
+            INSERT INTO expense_rollup
+            SELECT IFNULL(NEW.user_email, ''), IFNULL(NEW.month, ''), IFNULL(NEW.category, ''), IFNULL(NEW.amount, 0), 1
+            WHERE NEW.deleted_at IS NULL
+            ON CONFLICT DO UPDATE SET total = total + excluded.total, n = n + 1;
+        END""")
+
+    # Incomes have no trash, only hard deletes
+    c.execute("""CREATE TRIGGER trg_incomes_rollup_insert AFTER INSERT ON incomes
+        BEGIN
+            INSERT INTO income_rollup
+            VALUES (IFNULL(NEW.user_email, ''), IFNULL(NEW.month, ''), IFNULL(NEW.source, ''), IFNULL(NEW.amount, 0), 1)
+            ON CONFLICT DO UPDATE SET total = total + excluded.total, n = n + 1;
+        END""")
+    c.execute("""CREATE TRIGGER trg_incomes_rollup_delete AFTER DELETE ON incomes
+        BEGIN
+            UPDATE income_rollup SET total = total - IFNULL(OLD.amount, 0), n = n - 1
+            WHERE user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND source = IFNULL(OLD.source, '');
+            DELETE FROM income_rollup
+            WHERE n <= 0 AND user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND source = IFNULL(OLD.source, '');
+        END""")
+    c.execute("""CREATE TRIGGER trg_incomes_rollup_update
+        AFTER UPDATE OF user_email, date, source, amount ON incomes
+        BEGIN
+            UPDATE income_rollup SET total = total - IFNULL(OLD.amount, 0), n = n - 1
+            WHERE user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND source = IFNULL(OLD.source, '');
+            DELETE FROM income_rollup
+            WHERE n <= 0 AND user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '')
+              AND source = IFNULL(OLD.source, '');
+            INSERT INTO income_rollup
+            VALUES (IFNULL(NEW.user_email, ''), IFNULL(NEW.month, ''), IFNULL(NEW.source, ''), IFNULL(NEW.amount, 0), 1)
+            ON CONFLICT DO UPDATE SET total = total + excluded.total, n = n + 1;
+        END""")
+
+    for rollup, raw, key, live in (("expense_rollup", "expenses", "category", "deleted_at IS NULL"),
+                                   ("income_rollup", "incomes", "source", "1")):
+        c.execute(f"""INSERT INTO {rollup}
+            SELECT IFNULL(user_email, ''), IFNULL(month, ''), IFNULL({key}, ''), SUM(IFNULL(amount, 0)), COUNT(*)
+            FROM {raw} WHERE {live}
+            GROUP BY 1, 2, 3""")
+
+
+def _m005_recurring_incomes(c):
+    # The recurring engine needs the same columns on incomes as on expenses
+    c.execute("PRAGMA table_info(incomes)")
+    columns = [col[1] for col in c.fetchall()]
+    if 'is_recurring' not in columns:
+        c.execute("ALTER TABLE incomes ADD COLUMN is_recurring INTEGER DEFAULT 0")
+    if 'frequency' not in columns:
+        c.execute("ALTER TABLE incomes ADD COLUMN frequency TEXT")
+    if 'next_date' not in columns:
+        c.execute("ALTER TABLE incomes ADD COLUMN next_date TEXT")
+
+    # next_date used to be a full datetime ('2024-05-01T00:00:00'), which
+    # never compares <= a plain date string; keep just the date part
+    for table in ("expenses", "incomes"):
+        c.execute(f"UPDATE {table} SET next_date = substr(next_date, 1, 10) WHERE length(next_date) > 10")
+        c.execute(f"UPDATE {table} SET frequency = 'Monthly' WHERE is_recurring = 1 AND frequency IS NULL")
+
+    # Due templates across all users
+    c.execute("""CREATE INDEX idx_expenses_recurring_due ON expenses (next_date)
+                 WHERE is_recurring = 1 AND deleted_at IS NULL""")
+    c.execute("CREATE INDEX idx_incomes_recurring_due ON incomes (next_date) WHERE is_recurring = 1")
+
+
+def _m006_sent_alerts(c):
+    # One budget alert per (user, category, month)
+    c.execute('''CREATE TABLE sent_alerts (
+        user_email TEXT NOT NULL,
+        category TEXT NOT NULL,
+        month TEXT NOT NULL,
+        sent_at TEXT,
+        PRIMARY KEY (user_email, category, month)
+    ) WITHOUT ROWID''')
+
+
+def _m007_data_versions(c):
+    # Per-user counter bumped by every write to the user's data; cached reads
+    # are keyed on it (see cache.py)
+    c.execute('''CREATE TABLE data_versions (
+        user_email TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+    bump = ("INSERT INTO data_versions VALUES (IFNULL({row}.user_email, ''), 1) "
+            "ON CONFLICT DO UPDATE SET version = version + 1;")
+    for table in ("expenses", "incomes", "category_budgets"):
+        c.execute(f"""CREATE TRIGGER trg_{table}_version_insert AFTER INSERT ON {table}
+            BEGIN {bump.format(row='NEW')} END""")
+        c.execute(f"""CREATE TRIGGER trg_{table}_version_delete AFTER DELETE ON {table}
+            BEGIN {bump.format(row='OLD')} END""")
+        c.execute(f"""CREATE TRIGGER trg_{table}_version_update AFTER UPDATE ON {table}
+            BEGIN
+                {bump.format(row='NEW')}
+                UPDATE data_versions SET version = version + 1
+                WHERE OLD.user_email IS NOT NEW.user_email AND user_email = IFNULL(OLD.user_email, '');
+            END""")
+
+
+def _m008_forecasts(c):
+    # Precomputed next-month forecasts per (user, category); category '*' is the total
+    c.execute('''CREATE TABLE forecasts (
+        user_email TEXT NOT NULL,
+        category TEXT NOT NULL,
+        month TEXT NOT NULL,
+        amount REAL,
+        n_months INTEGER NOT NULL,
+        fitted_through TEXT NOT NULL,
+        data_version INTEGER NOT NULL,
+        PRIMARY KEY (user_email, category)
+    ) WITHOUT ROWID''')
+    # Users whose data predates data_versions need a row to be picked up
+    c.execute("""INSERT OR IGNORE INTO data_versions
+                 SELECT user_email, 0 FROM expenses WHERE user_email IS NOT NULL
+                 UNION SELECT user_email, 0 FROM incomes WHERE user_email IS NOT NULL""")
+
+
+def _m009_keyset_indexes(c):
+    # Manage Entries pages through rows by (sort column, id); these indexes
+    # return each page in order without a sort step
+    c.execute("""CREATE INDEX idx_expenses_user_date_id ON expenses (user_email, date, id)
+                 WHERE deleted_at IS NULL""")
+    c.execute("""CREATE INDEX idx_expenses_user_amount_id ON expenses (user_email, amount, id)
+                 WHERE deleted_at IS NULL""")
+    c.execute("CREATE INDEX idx_incomes_user_date_id ON incomes (user_email, date, id)")
+    c.execute("CREATE INDEX idx_incomes_user_amount_id ON incomes (user_email, amount, id)")
+
+
+def _m010_entries_fts(c):
+    # Full-text index over expense and income text. rowid = id * 2 for
+    # expenses, id * 2 + 1 for incomes, so triggers touch rows by key.
+    # 'owner' holds one token per user ('u' + hex(email)) so a search only
+    # walks that user's postings.
+    c.execute("""CREATE VIRTUAL TABLE entries_fts USING fts5(
+        description, label, owner,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4'
+    )""")
+    for table, label, tag in (("expenses", "category", 0), ("incomes", "source", 1)):
+        row = f"{{row}}.id * 2 + {tag}, {{row}}.description, {{row}}.{label}, 'u' || hex({{row}}.user_email)"
+        insert = f"INSERT INTO entries_fts (rowid, description, label, owner) VALUES ({row.format(row='NEW')});"
+        delete = f"DELETE FROM entries_fts WHERE rowid = OLD.id * 2 + {tag};"
+        c.execute(f"CREATE TRIGGER trg_{table}_fts_insert AFTER INSERT ON {table} BEGIN {insert} END")
+        c.execute(f"CREATE TRIGGER trg_{table}_fts_delete AFTER DELETE ON {table} BEGIN {delete} END")
+        c.execute(f"""CREATE TRIGGER trg_{table}_fts_update
+            AFTER UPDATE OF user_email, description, {label} ON {table}
+            BEGIN {delete} {insert} END""")
+        c.execute(f"""INSERT INTO entries_fts (rowid, description, label, owner)
+                      SELECT id * 2 + {tag}, description, {label}, 'u' || hex(user_email) FROM {table}""")
+
+
+def _m011_import_hash(c):
+    # Content hash of imported statement lines; re-importing is a no-op
+    for table in ("expenses", "incomes"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN import_hash TEXT")
+        c.execute(f"""CREATE UNIQUE INDEX idx_{table}_import_hash ON {table} (user_email, import_hash)
+                      WHERE import_hash IS NOT NULL""")
+
+
+def _m012_minor_units(c):
+    # Amounts become exact integers in minor units (paise/cents) with the
+    # currency they were entered in; conversion happens at read time against
+    # the dated rates in fx_rates. Float totals drifted by fractions of a
+    # paisa per row and never matched the raw rows exactly.
+    for name in ("idx_expenses_user_date", "idx_expenses_user_month", "idx_expenses_user_amount_id",
+                 "idx_incomes_user_date", "idx_incomes_user_month", "idx_incomes_user_amount_id"):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    for table in ("expenses", "incomes"):
+        for op in ("insert", "delete", "update"):
+            c.execute(f"DROP TRIGGER IF EXISTS trg_{table}_rollup_{op}")
+    c.execute("DROP TABLE expense_rollup")
+    c.execute("DROP TABLE income_rollup")
+
+    for table in ("expenses", "incomes", "category_budgets"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN amount_minor INTEGER NOT NULL DEFAULT 0")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN currency TEXT NOT NULL DEFAULT 'INR'")
+        c.execute(f"UPDATE {table} SET amount_minor = CAST(round(IFNULL(amount, 0) * 100) AS INTEGER)")
+        c.execute(f"ALTER TABLE {table} DROP COLUMN amount")
+
+    c.execute("""CREATE INDEX idx_expenses_user_date ON expenses
+                 (user_email, date, category, currency, amount_minor) WHERE deleted_at IS NULL""")
+    c.execute("""CREATE INDEX idx_expenses_user_month ON expenses
+                 (user_email, month, category, currency, amount_minor) WHERE deleted_at IS NULL""")
+    c.execute("""CREATE INDEX idx_expenses_user_amount_id ON expenses (user_email, amount_minor, id)
+                 WHERE deleted_at IS NULL""")
+    c.execute("CREATE INDEX idx_incomes_user_date ON incomes (user_email, date, source, currency, amount_minor)")
+    c.execute("CREATE INDEX idx_incomes_user_month ON incomes (user_email, month, source, currency, amount_minor)")
+    c.execute("CREATE INDEX idx_incomes_user_amount_id ON incomes (user_email, amount_minor, id)")
+
+    # Rollups gain a currency dimension; integer totals stay exact
+    for rollup, raw, key, live in (("expense_rollup", "expenses", "category", "deleted_at IS NULL"),
+                                   ("income_rollup", "incomes", "source", "1")):
+        c.execute(f'''CREATE TABLE {rollup} (
+            user_email TEXT NOT NULL,
+            month TEXT NOT NULL,
+            {key} TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            total_minor INTEGER NOT NULL DEFAULT 0,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, month, {key}, currency)
+        ) WITHOUT ROWID''')
+        match = (f"user_email = IFNULL(OLD.user_email, '') AND month = IFNULL(OLD.month, '') "
+                 f"AND {key} = IFNULL(OLD.{key}, '') AND currency = OLD.currency")
+        old_live = "OLD.deleted_at IS NULL" if live != "1" else "1"
+        new_live = "NEW.deleted_at IS NULL" if live != "1" else "1"
+        add = (f"INSERT INTO {rollup} "
+               f"SELECT IFNULL(NEW.user_email, ''), IFNULL(NEW.month, ''), IFNULL(NEW.{key}, ''), NEW.currency, NEW.amount_minor, 1 "
+               f"WHERE {new_live} "
+               f"ON CONFLICT DO UPDATE SET total_minor = total_minor + excluded.total_minor, n = n + 1;")
+        remove = (f"UPDATE {rollup} SET total_minor = total_minor - OLD.amount_minor, n = n - 1 "
+                  f"WHERE {old_live} AND {match}; "
+                  f"DELETE FROM {rollup} WHERE n <= 0 AND {match};")
+        watched = f"user_email, date, {key}, amount_minor, currency" + (", deleted_at" if live != "1" else "")
+        c.execute(f"CREATE TRIGGER trg_{raw}_rollup_insert AFTER INSERT ON {raw} BEGIN {add} END")
+        c.execute(f"CREATE TRIGGER trg_{raw}_rollup_delete AFTER DELETE ON {raw} BEGIN {remove} END")
+        c.execute(f"CREATE TRIGGER trg_{raw}_rollup_update AFTER UPDATE OF {watched} ON {raw} BEGIN {remove} {add} END")
+        c.execute(f"""INSERT INTO {rollup}
+            SELECT IFNULL(user_email, ''), IFNULL(month, ''), IFNULL({key}, ''), currency, SUM(amount_minor), COUNT(*)
+            FROM {raw} WHERE {live} GROUP BY 1, 2, 3, 4""")
+
+    # Value of one unit of `currency` in the base currency (INR) from
+    # rate_date on; the base currency itself is always 1
+    c.execute('''CREATE TABLE fx_rates (
+        currency TEXT NOT NULL,
+        rate_date TEXT NOT NULL,
+        rate REAL NOT NULL,
+        PRIMARY KEY (currency, rate_date)
+    ) WITHOUT ROWID''')
+    # Converted reads are cached per user; a rate change bumps the shared '*' version
+    bump = "INSERT INTO data_versions VALUES ('*', 1) ON CONFLICT DO UPDATE SET version = version + 1;"
+    for op in ("insert", "delete", "update"):
+        c.execute(f"CREATE TRIGGER trg_fx_rates_version_{op} AFTER {op.upper()} ON fx_rates BEGIN {bump} END")
+    c.execute("INSERT OR IGNORE INTO data_versions VALUES ('*', 0)")
+
+
+def _m013_trash_purge_indexes(c):
+    # Retention purge walks trash by age across users; receipt files are
+    # shared between rows, so deleting one checks for other references
+    c.execute("CREATE INDEX idx_expenses_deleted_at ON expenses (deleted_at) WHERE deleted_at IS NOT NULL")
+    c.execute("CREATE INDEX idx_expenses_receipt ON expenses (receipt_path) WHERE receipt_path IS NOT NULL")
+
+
+def _m014_balances(c):
+    # Per-user running totals for the Dashboard metrics: one row per
+    # (user, currency, period), period 'all' for lifetime or 'YYYY-MM'.
+    # Triggers keep both the lifetime and the month row current on every
+    # insert, edit, soft delete, restore and delete.
+    c.execute('''CREATE TABLE balances (
+        user_email TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        period TEXT NOT NULL,
+        income_minor INTEGER NOT NULL DEFAULT 0,
+        expense_minor INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_email, currency, period)
+    ) WITHOUT ROWID''')
+    for raw, column, live in (("incomes", "income_minor", "1"), ("expenses", "expense_minor", "deleted_at IS NULL")):
+        old_live = "OLD.deleted_at IS NULL" if live != "1" else "1"
+        new_live = "NEW.deleted_at IS NULL" if live != "1" else "1"
+        match = ("user_email = IFNULL(OLD.user_email, '') AND currency = OLD.currency "
+                 "AND period IN ('all', IFNULL(OLD.month, ''))")
+        add = (f"INSERT INTO balances (user_email, currency, period, {column}) "
+               f"SELECT IFNULL(NEW.user_email, ''), NEW.currency, p.period, NEW.amount_minor "
+               f"FROM (SELECT 'all' AS period UNION ALL SELECT IFNULL(NEW.month, '')) p "
+               f"WHERE {new_live} "
+               f"ON CONFLICT DO UPDATE SET {column} = {column} + excluded.{column};")
+        remove = (f"UPDATE balances SET {column} = {column} - OLD.amount_minor WHERE {old_live} AND {match}; "
+                  f"DELETE FROM balances WHERE income_minor = 0 AND expense_minor = 0 AND {match};")
+        watched = "user_email, date, amount_minor, currency" + (", deleted_at" if live != "1" else "")
+        c.execute(f"CREATE TRIGGER trg_{raw}_balance_insert AFTER INSERT ON {raw} BEGIN {add} END")
+        c.execute(f"CREATE TRIGGER trg_{raw}_balance_delete AFTER DELETE ON {raw} BEGIN {remove} END")
+        c.execute(f"CREATE TRIGGER trg_{raw}_balance_update AFTER UPDATE OF {watched} ON {raw} BEGIN {remove} {add} END")
+    c.execute(f"INSERT INTO balances {_BALANCES_FROM_RAW}")
+
+
+def _m015_session_generation(c):
+    # Session tokens carry this counter; logging out bumps it, which
+    # revokes every token issued before (see auth.py)
+    c.execute("ALTER TABLE users ADD COLUMN session_gen INTEGER NOT NULL DEFAULT 0")
+
+
+MIGRATIONS = [
+    _m001_base_schema,
+    _m002_query_indexes,
+    _m003_user_budgets,
+    _m004_monthly_rollups,
+    _m005_recurring_incomes,
+    _m006_sent_alerts,
+    _m007_data_versions,
+    _m008_forecasts,
+    _m009_keyset_indexes,
+    _m010_entries_fts,
+    _m011_import_hash,
+    _m012_minor_units,
+    _m013_trash_purge_indexes,
+    _m014_balances,
+    _m015_session_generation,
+]
+
+
+# ───────────────────────────────────────────────
+# Rollup maintenance
+# ───────────────────────────────────────────────
+_ROLLUP_SOURCES = {
+    # rollup table -> (raw table, group column, live-row filter)
+    "expense_rollup": ("expenses", "category", "deleted_at IS NULL"),
+    "income_rollup": ("incomes", "source", "1"),
+}
+
+
+# balances as the raw tables say they should be:
+# (user_email, currency, period, income_minor, expense_minor)
+_BALANCES_FROM_RAW = """
+    WITH raw AS (
+        SELECT IFNULL(user_email, '') AS user_email, currency, IFNULL(month, '') AS month,
+               amount_minor AS income, 0 AS expense
+        FROM incomes
+        UNION ALL
+        SELECT IFNULL(user_email, ''), currency, IFNULL(month, ''), 0, amount_minor
+        FROM expenses WHERE deleted_at IS NULL
+    )
+    SELECT user_email, currency, month AS period, SUM(income) AS income, SUM(expense) AS expense
+    FROM raw GROUP BY 1, 2, 3
+    UNION ALL
+    SELECT user_email, currency, 'all', SUM(income), SUM(expense) FROM raw GROUP BY 1, 2"""
+
+
+def rebuild_rollups(c):
+    for rollup, (raw, key, live) in _ROLLUP_SOURCES.items():
+        c.execute(f"DELETE FROM {rollup}")
+        c.execute(f"""INSERT INTO {rollup}
+            SELECT IFNULL(user_email, ''), IFNULL(month, ''), IFNULL({key}, ''), currency, SUM(amount_minor), COUNT(*)
+            FROM {raw} WHERE {live}
+            GROUP BY 1, 2, 3, 4""")
+
+
+def check_rollups(c):
+    # Rows where the rollup disagrees with the raw table:
+    # (table, user_email, month, key, currency, raw_total, raw_n, rollup_total, rollup_n)
+    # Totals are integer minor units, so they must match exactly.
+    mismatches = []
+    for rollup, (raw, key, live) in _ROLLUP_SOURCES.items():
+        rows = c.execute(f"""
+            SELECT user_email, month, k, currency, SUM(rt), SUM(rn), SUM(ut), SUM(un) FROM (
+                SELECT IFNULL(user_email, '') AS user_email, IFNULL(month, '') AS month, IFNULL({key}, '') AS k,
+                       currency, SUM(amount_minor) AS rt, COUNT(*) AS rn, 0 AS ut, 0 AS un
+                FROM {raw} WHERE {live} GROUP BY 1, 2, 3, 4
+                UNION ALL
+                SELECT user_email, month, {key}, currency, 0, 0, total_minor, n FROM {rollup}
+            )
+            GROUP BY 1, 2, 3, 4
+            HAVING SUM(rt) != SUM(ut) OR SUM(rn) != SUM(un)""").fetchall()
+        mismatches.extend((rollup,) + tuple(r) for r in rows)
+    return mismatches
+
+
+def rebuild_balances(c):
+    c.execute("DELETE FROM balances")
+    c.execute(f"INSERT INTO balances {_BALANCES_FROM_RAW}")
+
+
+def check_balances(c):
+    # Audit: balances that drifted from the raw tables, as
+    # (user_email, currency, period, raw_income, raw_expense, income, expense)
+    rows = c.execute(f"""
+        SELECT user_email, currency, period, SUM(ri), SUM(re), SUM(bi), SUM(be) FROM (
+            SELECT user_email, currency, period, income AS ri, expense AS re, 0 AS bi, 0 AS be
+            FROM ({_BALANCES_FROM_RAW})
+            UNION ALL
+            SELECT user_email, currency, period, 0, 0, income_minor, expense_minor FROM balances
+        )
+        GROUP BY 1, 2, 3
+        HAVING SUM(ri) != SUM(bi) OR SUM(re) != SUM(be)""").fetchall()
+    return [tuple(r) for r in rows]
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version + 1, len(MIGRATIONS) + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while we waited for the lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+                conn.rollback()
+                continue
+            MIGRATIONS[target - 1](conn.cursor())
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def init_db(path=None, count=None):
+    # The catalog and every shard share one schema
+    for p in all_paths(path, count):
+        _init_file(p)
+
+
+def _init_file(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+
+    # Freed pages can be returned a few at a time (retention.vacuum_step)
+    # instead of by a blocking VACUUM. Only takes effect before the first
+    # table exists; older files are converted once with enable_incremental_vacuum.
+    if conn.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL is persistent in the file: readers no longer block on the writer
+    conn.execute("PRAGMA journal_mode = WAL")
+    migrate(conn)
+    conn.close()
+
+
+def enable_incremental_vacuum(path=None):
+    # One-off full VACUUM that switches an existing file to auto_vacuum =
+    # INCREMENTAL; blocks writers while it runs. Returns False if already on.
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
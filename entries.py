@@ -0,0 +1,118 @@
+# Bulk changes from the Manage Entries and Trash grids.
+#
+# Each call is one transaction over the whole selection, and every
+# statement is scoped to the user, so ids from a stale or tampered page
+# can't reach anyone else's rows.
+from datetime import date, datetime
+
+import pandas as pd
+
+from money import to_minor
+
+# ids bound per statement, well under SQLite's variable limit
+CHUNK_IDS = 1000
+# table -> grid columns that can be edited in place
+EDITABLE = {
+    "expenses": ("date", "category", "amount", "description"),
+    "incomes": ("date", "source", "amount", "description"),
+}
+LABEL_COLUMN = {"expenses": "category", "incomes": "source"}
+
+
+def _marks(ids):
+    return ", ".join("?" * len(ids))
+
+
+def _write(conn, sql, params, ids):
+    # `sql` ends in "id IN"; run once per chunk of ids, all in one
+    # transaction -> rows changed
+    ids = [int(i) for i in ids]
+    changed = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for start in range(0, len(ids), CHUNK_IDS):
+            chunk = ids[start:start + CHUNK_IDS]
+            changed += conn.execute(f"{sql} ({_marks(chunk)})", params + chunk).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return changed
+
+
+def _iso_date(value):
+    # Grid dates arrive as date, Timestamp or text; impossible ones such as
+    # 2026-02-30 are refused before anything is written
+    try:
+        return date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f"Not a valid date: {value}") from None
+
+
+def entry_changes(table, before, after):
+    # Grid before/after (amount in major units) -> [(id, {column: value})]
+    # for rows with edited cells; blank or non-positive amounts are ignored.
+    # Raises ValueError for a date that doesn't exist.
+    old = before.set_index('id')
+    changes = []
+    for row in after.itertuples(index=False):
+        prev = old.loc[row.id]
+        new = {}
+        for col in EDITABLE[table]:
+            value, was = getattr(row, col), prev[col]
+            if col == "amount":
+                if pd.notna(value) and value > 0 and to_minor(value) != to_minor(was):
+                    new["amount_minor"] = to_minor(value)
+            elif pd.isna(value):
+                # only the description may be cleared
+                if col == "description" and pd.notna(was):
+                    new[col] = None
+            elif col == "date":
+                if _iso_date(value) != was:
+                    new[col] = _iso_date(value)
+            elif value != was:
+                new[col] = value
+        if new:
+            changes.append((int(row.id), new))
+    return changes
+
+
+def update_entries(conn, table, email, changes):
+    # Rows changing the same columns share one executemany; all in one transaction
+    groups = {}
+    for entry_id, new in changes:
+        cols = tuple(sorted(new))
+        groups.setdefault(cols, []).append([new[c] for c in cols] + [entry_id, email])
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for cols, rows in groups.items():
+            sets = ", ".join(f"{c} = ?" for c in cols)
+            conn.executemany(f"UPDATE {table} SET {sets} WHERE id = ? AND user_email = ?", rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(changes)
+
+
+def set_label(conn, table, email, ids, value):
+    # Same category (expenses) or source (incomes) for every selected row
+    return _write(conn, f"UPDATE {table} SET {LABEL_COLUMN[table]} = ? WHERE user_email = ? AND id IN",
+                  [value, email], ids)
+
+
+def move_to_trash(conn, email, ids):
+    return _write(conn, """UPDATE expenses SET deleted_at = ?
+                           WHERE user_email = ? AND deleted_at IS NULL AND id IN""",
+                  [datetime.now().isoformat(), email], ids)
+
+
+def restore_entries(conn, email, ids):
+    return _write(conn, """UPDATE expenses SET deleted_at = NULL
+                           WHERE user_email = ? AND deleted_at IS NOT NULL AND id IN""",
+                  [email], ids)
+
+
+def delete_incomes(conn, email, ids):
+    # Incomes have no trash; deleting is final
+    return _write(conn, "DELETE FROM incomes WHERE user_email = ? AND id IN", [email], ids)
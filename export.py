@@ -0,0 +1,100 @@
+# Streaming exports: rows go from a cursor to the output in chunks, so
+# memory stays flat however many years of entries a user has.
+import csv
+import glob
+import io
+import os
+import tempfile
+import time
+
+EXPORT_CHUNK_ROWS = 5000
+# Prepared files not downloaded within this many seconds are removed
+EXPORT_MAX_AGE = 3600
+_PREFIX = "tracker-export-"
+
+EXPORT_TABLES = {
+    # table -> exported columns, live-row filter
+    "expenses": (("id", "date", "category", "amount", "currency", "description"), "deleted_at IS NULL"),
+    "incomes": (("id", "date", "source", "amount", "currency", "description"), "1"),
+}
+# Amounts are written as exact decimal strings built from the stored minor units
+_EXPRESSIONS = {"amount": "printf('%d.%02d', amount_minor / 100, amount_minor % 100)"}
+
+
+def new_export_file(ext):
+    # Empty temp file for a prepared export; clears out abandoned ones first
+    for old in glob.glob(os.path.join(tempfile.gettempdir(), _PREFIX + "*")):
+        try:
+            if os.path.getmtime(old) < time.time() - EXPORT_MAX_AGE:
+                os.remove(old)
+        except OSError:
+            pass   # already gone
+    fd, path = tempfile.mkstemp(prefix=_PREFIX, suffix=f".{ext}")
+    os.close(fd)
+    return path
+
+
+def reader(path):
+    # Callable for st.download_button: the file is read only when the user
+    # clicks, and stays for further clicks until the next export replaces
+    # it or new_export_file() clears it out as abandoned
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+
+def _cursor(conn, table, email, from_d=None, to_d=None):
+    cols, live = EXPORT_TABLES[table]
+    q = f"SELECT {', '.join(_EXPRESSIONS.get(c, c) for c in cols)} FROM {table} WHERE user_email = ? AND {live}"
+    params = [email]
+    if from_d:
+        q += " AND date >= ?"
+        params.append(from_d)
+    if to_d:
+        q += " AND date <= ?"
+        params.append(to_d)
+    return conn.execute(q + " ORDER BY date, id", params)
+
+
+def iter_csv(conn, table, email, from_d=None, to_d=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    # Yields encoded CSV chunks, header first
+    cur = _cursor(conn, table, email, from_d, to_d)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_TABLES[table][0])
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if rows:
+            writer.writerows(rows)
+        yield buf.getvalue().encode()
+        if not rows:
+            return
+        buf.seek(0)
+        buf.truncate()
+
+
+def write_csv(conn, table, email, fileobj, from_d=None, to_d=None):
+    for chunk in iter_csv(conn, table, email, from_d, to_d):
+        fileobj.write(chunk)
+
+
+def write_parquet(conn, table, email, path, from_d=None, to_d=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    # One row group per chunk; needs pyarrow (installed alongside streamlit)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    cols = EXPORT_TABLES[table][0]
+    types = {"id": pa.int64(), "date": pa.date32(), "amount": pa.decimal128(18, 2)}
+    schema = pa.schema([(c, types.get(c, pa.string())) for c in cols])
+    cur = _cursor(conn, table, email, from_d, to_d)
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        while rows := cur.fetchmany(chunk_rows):
+            columns = list(zip(*rows))
+            arrays = [pa.array(values, pa.string()).cast(schema.field(c).type) if c in ("date", "amount")
+                      else pa.array(values, schema.field(c).type)
+                      for c, values in zip(cols, columns)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
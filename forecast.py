@@ -0,0 +1,153 @@
+# Batched expense forecasting.
+#
+# Every (user, category) monthly series - plus a per-user total under the
+# category "*" - is fitted at once with weighted least squares on a stacked
+# NumPy array: intercept + linear trend, plus yearly seasonal terms for
+# series with at least two years of history. Results are stored in the
+# forecasts table and only refitted for users whose data changed or when a
+# new month has closed. Series are fitted in the base currency, each
+# month converted at its closing rate.
+import numpy as np
+import pandas as pd
+
+from money import BASE_CURRENCY, convert, load_rates, month_end, rates_at
+
+TOTAL = "*"
+MIN_MONTHS = 3
+SEASONAL_MIN_MONTHS = 24
+USERS_PER_BATCH = 2000
+
+# ridge applied to coefficients a series can't support (effectively drops them)
+_OFF = 1e9
+_EPS = 1e-9
+
+
+def _month_num(month):
+    return int(month[:4]) * 12 + int(month[5:7]) - 1
+
+
+def _month_str(num):
+    return f"{num // 12:04d}-{num % 12 + 1:02d}"
+
+
+def _features(month_nums, target):
+    # columns: intercept, trend (years relative to target), sin/cos of month-of-year
+    t = (month_nums - target) / 12.0
+    angle = 2 * np.pi * (month_nums % 12) / 12.0
+    return np.column_stack([np.ones_like(t), t, np.sin(angle), np.cos(angle)])
+
+
+def fit_series(df, last_closed, target, seasonal=True):
+    # df: user_email, category, month, total (closed months only)
+    # -> DataFrame user_email, category, amount, n_months for series with enough history
+    if df.empty:
+        return pd.DataFrame(columns=["user_email", "category", "amount", "n_months"])
+
+    month_nums = df['month'].map(_month_num).to_numpy()
+    sid = df.groupby(['user_email', 'category'], sort=False).ngroup().to_numpy()
+    keys = df[['user_email', 'category']].drop_duplicates().reset_index(drop=True)
+
+    origin = month_nums.min()
+    T = last_closed - origin + 1
+    S = len(keys)
+    col = month_nums - origin
+
+    # Stacked (series x month) matrix; months a category had no spend are 0
+    Y = np.zeros((S, T))
+    np.add.at(Y, (sid, col), df['total'].to_numpy(dtype=float))
+    first = np.full(S, T)
+    np.minimum.at(first, sid, col)
+    W = (np.arange(T)[None, :] >= first[:, None]).astype(float)
+    n = W.sum(axis=1)
+
+    X = _features(origin + np.arange(T), target)
+    x_next = _features(np.array([target]), target)[0]
+
+    A = np.einsum('tk,st,tl->skl', X, W, X)
+    b = np.einsum('tk,st->sk', X, W * Y)
+    lam = np.full((S, X.shape[1]), _EPS)
+    if not seasonal:
+        lam[:, 2:] = _OFF
+    else:
+        lam[n < SEASONAL_MIN_MONTHS, 2:] = _OFF
+    A[:, np.arange(X.shape[1]), np.arange(X.shape[1])] += lam
+    beta = np.linalg.solve(A, b[..., None])[..., 0]
+    pred = np.clip(beta @ x_next, 0, None)
+
+    out = keys.assign(amount=pred, n_months=n.astype(int))
+    return out[out['n_months'] >= MIN_MONTHS].reset_index(drop=True)
+
+
+def _stale_users(conn, last_closed_month):
+    rows = conn.execute("""
+        SELECT v.user_email FROM data_versions v
+        LEFT JOIN (SELECT user_email, MIN(fitted_through) AS ft, MIN(data_version) AS dv
+                   FROM forecasts GROUP BY user_email) f ON f.user_email = v.user_email
+        WHERE v.user_email != '*' AND (f.user_email IS NULL OR f.ft < ? OR f.dv != v.version)
+    """, (last_closed_month,)).fetchall()
+    return [r[0] for r in rows]
+
+
+def refresh_forecasts(conn, today, users=None, seasonal=True):
+    # Refit stale users (or the given ones); returns the number of users refitted
+    last_closed = today.year * 12 + today.month - 2
+    target = last_closed + 2
+    last_closed_month = _month_str(last_closed)
+    if users is None:
+        users = _stale_users(conn, last_closed_month)
+    rates = load_rates(conn)
+
+    for start in range(0, len(users), USERS_PER_BATCH):
+        batch = users[start:start + USERS_PER_BATCH]
+        marks = ", ".join("?" * len(batch))
+        df = pd.read_sql_query(f"""
+            SELECT user_email, category, month, currency, total_minor FROM expense_rollup
+            WHERE user_email IN ({marks}) AND month <= ?
+        """, conn, params=batch + [last_closed_month])
+        df['total'] = convert(rates, df['total_minor'], df['currency'], month_end(df['month']), BASE_CURRENCY)
+        df = df.groupby(['user_email', 'category', 'month'], as_index=False, sort=False)['total'].sum()
+        totals = df.groupby(['user_email', 'month'], as_index=False, sort=False)['total'].sum()
+        df = pd.concat([df, totals.assign(category=TOTAL)], ignore_index=True)
+        fitted = fit_series(df, last_closed, target, seasonal)
+        versions = dict(conn.execute(
+            f"SELECT user_email, version FROM data_versions WHERE user_email IN ({marks})", batch).fetchall())
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM forecasts WHERE user_email = ?", [(u,) for u in batch])
+            conn.executemany(
+                "INSERT INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(r.user_email, r.category, _month_str(target), float(r.amount), int(r.n_months),
+                  last_closed_month, versions.get(r.user_email, 0))
+                 for r in fitted.itertuples(index=False)])
+            # users without enough history get a marker row so they aren't refitted every run
+            have = set(fitted['user_email'])
+            conn.executemany(
+                "INSERT INTO forecasts VALUES (?, ?, ?, NULL, 0, ?, ?)",
+                [(u, TOTAL, _month_str(target), last_closed_month, versions.get(u, 0))
+                 for u in batch if u not in have])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(users)
+
+
+def forecast_stamp(conn, email):
+    # -> (fitted_through, data_version) of the user's stored forecast; a
+    # refit always changes it, so it keys cached forecasts
+    return conn.execute("SELECT MIN(fitted_through), MIN(data_version) FROM forecasts WHERE user_email = ?",
+                        (email,)).fetchone()
+
+
+def user_forecast(conn, email, today, to_currency=BASE_CURRENCY):
+    # Stored forecast rows for one user, computing them on the spot if missing;
+    # amounts are stored in the base currency and converted at today's rate
+    q = "SELECT category, month, amount, n_months FROM forecasts WHERE user_email = ? ORDER BY category"
+    df = pd.read_sql_query(q, conn, params=(email,))
+    if df.empty:
+        refresh_forecasts(conn, today, users=[email])
+        df = pd.read_sql_query(q, conn, params=(email,))
+    if to_currency != BASE_CURRENCY:
+        df['amount'] /= rates_at(load_rates(conn), [to_currency], [today])[0]
+    return df
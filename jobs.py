@@ -0,0 +1,70 @@
+# Background jobs, run off the render path by one daemon thread per process
+# (or from cron via manage.py).
+import logging
+import os
+import threading
+import time
+from datetime import date
+
+import db
+import recurring
+
+log = logging.getLogger(__name__)
+
+JOBS_INTERVAL = int(os.environ.get("TRACKER_JOBS_INTERVAL", "3600"))
+# TRACKER_JOBS=0 leaves the jobs to cron / another process
+JOBS_ENABLED = os.environ.get("TRACKER_JOBS", "1") != "0"
+
+
+def job_recurring(conn):
+    return recurring.run_recurring(conn)
+
+
+def job_forecasts(conn):
+    import forecast  # pandas/numpy: keep them out of the app's startup path
+    return forecast.refresh_forecasts(conn, date.today())
+
+
+def job_trash(conn):
+    import retention
+    return retention.purge_trash(conn)
+
+
+def job_vacuum(conn):
+    import retention
+    return retention.vacuum_step(conn)
+
+
+JOBS = [
+    ("recurring", job_recurring),
+    ("forecasts", job_forecasts),
+    ("trash", job_trash),
+    ("vacuum", job_vacuum),
+]
+
+
+def run_jobs():
+    # Every job runs once per shard (see db.py); a failing shard doesn't
+    # stop the others
+    for name, job in JOBS:
+        for path in db.shard_paths():
+            try:
+                with db.connection(path) as conn:
+                    result = job(conn)
+                log.info("job %s on %s: %s", name, path, result)
+            except Exception:
+                log.exception("job %s failed on %s", name, path)
+
+
+def _loop(interval):
+    while True:
+        run_jobs()
+        time.sleep(interval)
+
+
+def start_scheduler(interval=JOBS_INTERVAL):
+    if not JOBS_ENABLED:
+        return None
+    thread = threading.Thread(target=_loop, args=(interval,), name="background-jobs", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,432 @@
+# Maintenance commands for the tracker database.
+#   python manage.py check-rollups
+#   python manage.py rebuild-rollups
+#   python manage.py check-balances
+#   python manage.py rebuild-balances
+#   python manage.py run-recurring [--today YYYY-MM-DD]
+#   python manage.py refresh-forecasts [--all]
+#   python manage.py startup-report [--email E] [--budget-ms N]
+#   python manage.py export EMAIL OUT.csv|OUT.parquet [--table incomes] [--from D] [--to D]
+#   python manage.py import EMAIL STATEMENT.csv --date-col C --desc-col C (--amount-col C | --debit-col C --credit-col C)
+#                                      [--currency USD]
+#   python manage.py seed [--users N] [--expenses N] [--months N] [--end D] [--seed N]
+#   python manage.py bench [--users N] [--repeat N] [--page P ...] [--json OUT] [--budget-ms N]
+#   python manage.py bench-login [--clients N] [--logins N] [--rounds N]
+#   python manage.py purge-trash [--days N]
+#   python manage.py vacuum [--pages N] [--enable]
+#   python manage.py report [--month YYYY-MM] [--out DIR] [--workers N] [--format csv|html|both] [--currency C]
+#   python manage.py split-shards --shards N [--from N] [--keep]
+#
+# Commands that touch every user's data run once per shard (TRACKER_SHARDS,
+# see db.py); --db names the catalog.
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import date
+
+import db
+import forecast
+import recurring
+
+
+def cmd_check_rollups(args):
+    mismatches = []
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            mismatches += db.check_rollups(conn)
+    for table, email, month, key, currency, raw_total, raw_n, total, n in mismatches:
+        print(f"{table}: {email} {month} {key} {currency}: raw {raw_total} ({raw_n} rows) != rollup {total} ({n} rows)")
+    print(f"{len(mismatches)} mismatched rollup rows")
+    return 1 if mismatches else 0
+
+
+def cmd_rebuild_rollups(args):
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            db.rebuild_rollups(conn)
+            conn.commit()
+    print("Rollups rebuilt")
+    return 0
+
+
+def cmd_check_balances(args):
+    drift = []
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            drift += db.check_balances(conn)
+    for email, currency, period, raw_income, raw_expense, income, expense in drift:
+        print(f"{email} {currency} {period}: raw income {raw_income} expenses {raw_expense} "
+              f"!= balance income {income} expenses {expense}")
+    print(f"{len(drift)} drifted balance rows")
+    return 1 if drift else 0
+
+
+def cmd_rebuild_balances(args):
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            db.rebuild_balances(conn)
+            conn.commit()
+    print("Balances rebuilt")
+    return 0
+
+
+def cmd_run_recurring(args):
+    today = date.fromisoformat(args.today) if args.today else None
+    added = {"expenses": 0, "incomes": 0}
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            for key, n in recurring.run_recurring(conn, today).items():
+                added[key] += n
+    print(f"Added {added['expenses']} recurring expenses and {added['incomes']} incomes")
+    return 0
+
+
+def cmd_refresh_forecasts(args):
+    n = 0
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            users = None
+            if args.all:
+                users = [r[0] for r in conn.execute("SELECT user_email FROM data_versions WHERE user_email != '*'")]
+            n += forecast.refresh_forecasts(conn, date.today(), users=users)
+    print(f"Refitted forecasts for {n} users")
+    return 0
+
+
+# Runs app.py once in a fresh interpreter and reports what the first render cost
+_STARTUP_PROBE = r"""
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+email, page = sys.argv[1], sys.argv[2]
+before = set(sys.modules)
+t0 = time.perf_counter()
+at = AppTest.from_file(sys.argv[3], default_timeout=300)
+if email:
+    at.session_state['user_email'] = email
+    at.session_state['page'] = page
+at.run()
+elapsed = time.perf_counter() - t0
+loaded = set(sys.modules) - before
+print(json.dumps({
+    "ms": elapsed * 1000,
+    "heavy": sorted(m for m in HEAVY if m in loaded),
+    "modules": len(loaded),
+    "pages": list(at.sidebar.radio[0].options) if email and len(at.sidebar.radio) else [],
+    "errors": [str(e.value) for e in at.exception],
+}))
+"""
+HEAVY_MODULES = ["pandas", "numpy", "plotly", "bcrypt", "smtplib", "sklearn", "pyarrow", "PIL"]
+
+
+def _probe(email, page, env):
+    code = f"HEAVY = {HEAVY_MODULES!r}\n" + _STARTUP_PROBE
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    out = subprocess.run([sys.executable, "-c", code, email, page, app],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def cmd_startup_report(args):
+    env = dict(os.environ, TRACKER_JOBS="0")
+    if args.db:
+        env["TRACKER_DB"] = args.db
+    email = args.email
+    if not email:
+        with db.connection(args.db) as conn:
+            row = conn.execute("SELECT email FROM users LIMIT 1").fetchone()
+        email = row[0] if row else "startup-report@example.com"
+
+    results = [("(login)", _probe("", "", env))]
+    first = _probe(email, "Dashboard", env)
+    results.append(("Dashboard", first))
+    for page in first["pages"]:
+        if page != "Dashboard":
+            results.append((page, _probe(email, page, env)))
+
+    over = 0
+    print(f"{'page':<16} {'cold ms':>9} {'modules':>8}  heavy imports")
+    for page, r in results:
+        flag = ""
+        if args.budget_ms and r["ms"] > args.budget_ms:
+            flag = "  OVER BUDGET"
+            over += 1
+        if r["errors"]:
+            flag += f"  ERROR: {r['errors'][0]}"
+        print(f"{page:<16} {r['ms']:>9.0f} {r['modules']:>8}  {', '.join(r['heavy']) or '-'}{flag}")
+    return 1 if over else 0
+
+
+def cmd_export(args):
+    import export
+    with db.user_connection(args.email, args.db) as conn:
+        range_ = dict(from_d=args.from_d, to_d=args.to_d)
+        if args.out.endswith(".parquet"):
+            export.write_parquet(conn, args.table, args.email, args.out, **range_)
+        else:
+            with open(args.out, "wb") as f:
+                export.write_csv(conn, args.table, args.email, f, **range_)
+    print(f"Wrote {args.out}")
+    return 0
+
+
+def cmd_import(args):
+    import pandas as pd
+    import importer
+    raw = pd.read_csv(args.file, dtype=str)
+    parsed = importer.parse_statement(raw, args.date_col, args.desc_col, args.amount_col, args.debit_col,
+                                      args.credit_col, dayfirst=args.dayfirst)
+
+    def progress(done, total):
+        print(f"\r{done:,}/{total:,} rows", end="", file=sys.stderr)
+
+    with db.user_connection(args.email, args.db) as conn:
+        result = importer.import_statement(conn, args.email, parsed, progress=progress, currency=args.currency)
+    print(file=sys.stderr)
+    print(f"{len(raw):,} lines, {result['rows']:,} parsed: {result['expenses']:,} expenses, "
+          f"{result['incomes']:,} incomes, {result['duplicates']:,} duplicates "
+          f"in {result['seconds']:.2f}s ({result['rows_per_sec']:,.0f} rows/sec)")
+    return 0
+
+
+def cmd_seed(args):
+    import time
+    import seed
+    end = date.fromisoformat(args.end) if args.end else date.today()
+
+    def progress(done, total):
+        print(f"\r{done:,}/{total:,} users", end="", file=sys.stderr)
+
+    t0 = time.perf_counter()
+    counts = seed.generate(args.db, users=args.users, expenses_per_user=args.expenses, months=args.months,
+                           end=end, seed=args.seed, progress=progress)
+    print(file=sys.stderr)
+    print(f"Seeded {counts['users']:,} users, {counts['expenses']:,} expenses, {counts['incomes']:,} incomes, "
+          f"{counts['budgets']:,} budgets through {end} in {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+def cmd_bench(args):
+    import bench
+    unknown = sorted(set(args.page or []) - set(bench.PAGES))
+    if unknown:
+        print(f"Unknown page(s): {', '.join(unknown)}; choose from {', '.join(bench.PAGES)}")
+        return 2
+    with db.connection(args.db) as conn:
+        emails = bench.sample_users(conn, args.users, args.seed)
+    if not emails:
+        print("No users to benchmark (run 'manage.py seed' first)")
+        return 1
+    results = bench.run(emails, repeat=args.repeat, pages=args.page, path=args.db)
+
+    over = 0
+    print(f"{len(emails)} users x {args.repeat} runs")
+    print(f"{'page':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'peak KB':>9}")
+    for r in results:
+        flag = ""
+        if args.budget_ms and r["p95"] > args.budget_ms:
+            flag = "  OVER BUDGET"
+            over += 1
+        print(f"{r['page']:<16} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {r['max']:>8.1f} "
+              f"{r['peak_kb']:>9.0f}{flag}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if over else 0
+
+
+def cmd_bench_login(args):
+    import bench
+    results = bench.run_login(args.clients, args.logins, args.rounds)
+    print(f"{args.clients} concurrent clients x {args.logins} logins")
+    print(f"{'mode':<26} {'logins/s':>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in results:
+        print(f"{r['mode']:<26} {r['per_sec']:>10.1f} {r['p50']:>9.1f} {r['p95']:>9.1f}")
+    return 0
+
+
+def cmd_report(args):
+    import reports
+    if args.month:
+        month = args.month
+    else:
+        today = date.today()
+        month = f"{today.year - (today.month == 1)}-{(today.month - 2) % 12 + 1:02d}"
+    formats = ("csv", "html") if args.format == "both" else (args.format,)
+
+    def progress(done, total):
+        print(f"\r{done:,}/{total:,} users", end="", file=sys.stderr)
+
+    s = reports.run_reports(args.db or db.DB_PATH, month, args.out, workers=args.workers, formats=formats,
+                            currency=args.currency, progress=progress)
+    print(file=sys.stderr)
+    print(f"{month}: {s['users']:,} users, {s['files']:,} files in {os.path.join(args.out, month)}")
+    print(f"  {s['seconds']:.1f}s wall, {s['worker_seconds']:.1f}s in {s['workers']} workers, "
+          f"{s['users_per_sec']:,.0f} users/sec")
+    print(f"  income {s['income']:,.2f} {s['currency']}, expenses {s['expenses']:,.2f} {s['currency']}, "
+          f"{s['over_budget_users']:,} users over budget")
+    for err in s["errors"][:10]:
+        print(f"  ERROR {err}")
+    return 1 if s["errors"] else 0
+
+
+def cmd_purge_trash(args):
+    import retention
+    days = retention.TRASH_RETENTION_DAYS if args.days is None else args.days
+    result = {"rows": 0, "receipts": 0}
+    for path in db.shard_paths(args.db):
+        with db.connection(path) as conn:
+            for key, n in retention.purge_trash(conn, days, db_path=args.db).items():
+                result[key] += n
+    print(f"Purged {result['rows']:,} trashed expenses older than {days:g} days "
+          f"and {result['receipts']:,} unreferenced receipts")
+    return 0
+
+
+def cmd_vacuum(args):
+    import retention
+    status = 0
+    for path in db.all_paths(args.db):
+        if args.enable:
+            if db.enable_incremental_vacuum(path):
+                print(f"{path}: switched to auto_vacuum = INCREMENTAL (full VACUUM done)")
+            else:
+                print(f"{path}: auto_vacuum = INCREMENTAL already on")
+        with db.connection(path) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                print(f"{path}: incremental vacuum is off for this file; run 'vacuum --enable' once")
+                status = 1
+                continue
+            freed = retention.vacuum_step(conn, args.pages)
+            left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        print(f"{path}: freed {freed:,} pages, {left:,} free pages left")
+    return status
+
+
+def cmd_split_shards(args):
+    import time
+    import shards
+
+    def progress(done, total):
+        print(f"\r{done:,}/{total:,} source files", end="", file=sys.stderr)
+
+    t0 = time.perf_counter()
+    try:
+        copied = shards.split(args.db, args.shards, from_count=args.from_count, keep=args.keep, progress=progress)
+    except ValueError as e:
+        print(file=sys.stderr)
+        print(f"Split failed: {e}")
+        return 1
+    print(file=sys.stderr)
+    for table, n in copied.items():
+        print(f"  {table:<18} {n:>12,} rows")
+    for path in db.shard_paths(args.db, args.shards):
+        print(f"  {path}")
+    print(f"Split into {args.shards} shard(s) in {time.perf_counter() - t0:.1f}s; "
+          f"restart the app with TRACKER_SHARDS={args.shards}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tracker maintenance commands")
+    parser.add_argument("--db", default=None, help="database file (default: $TRACKER_DB or tracker.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("check-rollups", help="verify monthly rollups against raw tables").set_defaults(func=cmd_check_rollups)
+    sub.add_parser("rebuild-rollups", help="recompute monthly rollups from raw tables").set_defaults(func=cmd_rebuild_rollups)
+    sub.add_parser("check-balances", help="audit running balances against raw tables").set_defaults(func=cmd_check_balances)
+    sub.add_parser("rebuild-balances", help="recompute running balances from raw tables").set_defaults(func=cmd_rebuild_balances)
+
+    p = sub.add_parser("run-recurring", help="materialise due recurring expenses/incomes for all users")
+    p.add_argument("--today", help="treat this date as today (default: the real date)")
+    p.set_defaults(func=cmd_run_recurring)
+
+    p = sub.add_parser("refresh-forecasts", help="refit next-month forecasts for users whose data changed")
+    p.add_argument("--all", action="store_true", help="refit every user")
+    p.set_defaults(func=cmd_refresh_forecasts)
+
+    p = sub.add_parser("startup-report", help="cold-start cost of each page of app.py")
+    p.add_argument("--email", help="user to render pages as (default: first user in the database)")
+    p.add_argument("--budget-ms", type=float, help="fail if any page's cold render exceeds this")
+    p.set_defaults(func=cmd_startup_report)
+
+    p = sub.add_parser("export", help="stream one user's expenses/incomes to CSV or Parquet")
+    p.add_argument("email")
+    p.add_argument("out", help="output file; .parquet selects Parquet, anything else CSV")
+    p.add_argument("--table", choices=["expenses", "incomes"], default="expenses")
+    p.add_argument("--from", dest="from_d", help="first date (YYYY-MM-DD)")
+    p.add_argument("--to", dest="to_d", help="last date (YYYY-MM-DD)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="bulk-import a CSV bank/card statement for one user")
+    p.add_argument("email")
+    p.add_argument("file")
+    p.add_argument("--date-col", required=True)
+    p.add_argument("--desc-col", required=True)
+    p.add_argument("--amount-col", help="signed amount column (negative = expense)")
+    p.add_argument("--debit-col")
+    p.add_argument("--credit-col")
+    p.add_argument("--dayfirst", action="store_true", help="dates are day-first (31/01/2025)")
+    p.add_argument("--currency", default="INR", help="currency of the statement amounts (default: INR)")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("seed", help="fill the database with deterministic synthetic users and entries")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--expenses", type=int, default=1000, help="average expenses per user")
+    p.add_argument("--months", type=int, default=36, help="months of history per user")
+    p.add_argument("--end", help="last date of generated history (default: today)")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=cmd_seed)
+
+    p = sub.add_parser("bench", help="latency percentiles and memory of each page's queries")
+    p.add_argument("--users", type=int, default=20, help="number of users sampled")
+    p.add_argument("--repeat", type=int, default=5, help="timed runs per user and page")
+    p.add_argument("--page", action="append", help="only this page (repeatable)")
+    p.add_argument("--seed", type=int, default=0, help="user sample seed")
+    p.add_argument("--json", help="also write the results to this file")
+    p.add_argument("--budget-ms", type=float, help="fail if any page's p95 exceeds this")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("bench-login", help="login throughput under concurrent load")
+    p.add_argument("--clients", type=int, default=16, help="concurrent sessions")
+    p.add_argument("--logins", type=int, default=4, help="logins per session")
+    p.add_argument("--rounds", type=int, help="bcrypt cost (default: $TRACKER_BCRYPT_ROUNDS or 12)")
+    p.set_defaults(func=cmd_bench_login)
+
+    p = sub.add_parser("purge-trash", help="delete trashed expenses past the retention period")
+    p.add_argument("--days", type=float, help="retention in days (default: $TRACKER_TRASH_DAYS or 30)")
+    p.set_defaults(func=cmd_purge_trash)
+
+    p = sub.add_parser("vacuum", help="return free pages to the filesystem in a bounded step")
+    p.add_argument("--pages", type=int, default=2000, help="most pages to free in this step")
+    p.add_argument("--enable", action="store_true",
+                   help="first switch an older database to incremental auto-vacuum (one full VACUUM)")
+    p.set_defaults(func=cmd_vacuum)
+
+    p = sub.add_parser("report", help="monthly statements for every user, built in parallel")
+    p.add_argument("--month", help="YYYY-MM (default: last month)")
+    p.add_argument("--out", default="reports", help="output directory (default: reports)")
+    p.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    p.add_argument("--format", choices=["csv", "html", "both"], default="both")
+    p.add_argument("--currency", default="INR", help="currency of the statements (default: INR)")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("split-shards", help="move user data into N shard files (app stopped)")
+    p.add_argument("--shards", type=int, required=True, help="new number of shards")
+    p.add_argument("--from", dest="from_count", type=int,
+                   help="current number of shards (default: $TRACKER_SHARDS or 1)")
+    p.add_argument("--keep", action="store_true", help="leave the copied rows in the old files too")
+    p.set_defaults(func=cmd_split_shards)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "func", None) is cmd_import and not (args.amount_col or (args.debit_col and args.credit_col)):
+        parser.error("import needs --amount-col or both --debit-col and --credit-col")
+    db.init_db(args.db)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+
+import db
+
+# Amounts are stored as integers in minor units (paise/cents) together with
+# the currency they were entered in. fx_rates holds dated rates to the base
+# currency; conversion happens on whole arrays at read time.
+BASE_CURRENCY = "INR"
+
+MINOR_PER_UNIT = 100
+
+
+def to_minor(amount):
+    # 12.345 -> 1235; goes through Decimal so 0.1 + 0.2 style float noise
+    # never leaks into the stored value
+    return int((Decimal(str(amount)) * MINOR_PER_UNIT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_major(minor):
+    return np.asarray(minor, dtype=np.float64) / MINOR_PER_UNIT
+
+
+def month_end(months):
+    # 'YYYY-MM' -> last day of that month, the date month-level rows are converted at
+    months = np.asarray(months, dtype="datetime64[M]")
+    return (months + 1).astype("datetime64[D]") - 1
+
+
+# ───────────────────────────────────────────────
+# Rates
+# ───────────────────────────────────────────────
+def load_rates(conn):
+    # {currency: (sorted rate dates, rates)}
+    df = pd.read_sql_query("SELECT currency, rate_date, rate FROM fx_rates ORDER BY currency, rate_date", conn)
+    return {cur: (g['rate_date'].to_numpy(dtype="datetime64[D]"), g['rate'].to_numpy(dtype=np.float64))
+            for cur, g in df.groupby('currency', sort=False)}
+
+
+def rates_at(rates, currencies, dates):
+    # Rate to base for every (currency, date) pair: the latest rate on or
+    # before the date, or the earliest known rate for older dates. The base
+    # currency, and currencies without any rate, count as 1.
+    currencies = np.asarray(currencies, dtype=object)
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    out = np.ones(len(dates))
+    for cur in pd.unique(currencies):
+        if cur == BASE_CURRENCY or cur not in rates:
+            continue
+        mask = currencies == cur
+        rate_dates, values = rates[cur]
+        idx = np.searchsorted(rate_dates, dates[mask], side="right") - 1
+        out[mask] = values[np.maximum(idx, 0)]
+    return out
+
+
+def convert(rates, minor, currencies, dates, to_currency):
+    # Minor-unit amounts in mixed currencies -> major units of to_currency,
+    # each at the rates in force on its own date
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    base = to_major(minor) * rates_at(rates, currencies, dates)
+    return base / rates_at(rates, np.full(len(dates), to_currency, dtype=object), dates)
+
+
+def save_rate(conn, currency, rate_date, rate):
+    conn.execute("INSERT INTO fx_rates VALUES (?, ?, ?) ON CONFLICT DO UPDATE SET rate = excluded.rate",
+                 (currency, rate_date, float(rate)))
+    conn.commit()
+
+
+def save_rate_everywhere(currency, rate_date, rate, path=None):
+    # Rates are global; each shard keeps its own copy (see db.py)
+    for p in db.all_paths(path):
+        with db.connection(p) as conn:
+            save_rate(conn, currency, rate_date, rate)
@@ -0,0 +1,216 @@
+# Per-rerun instrumentation.
+#
+# app.py opens a run per script rerun and marks its sections; pooled
+# connections hand out ProfiledCursor (see db.py), which times every
+# statement including the fetches and counts the rows; QueryCache reports
+# hits and misses. Finished runs and slow statements are kept in memory
+# for the Diagnostics page; slow statements also go to the
+# "tracker.slow_query" logger.
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+PROFILE_ENABLED = os.environ.get("TRACKER_PROFILE", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("TRACKER_SLOW_QUERY_MS", "200"))
+PROFILE_RUNS = int(os.environ.get("TRACKER_PROFILE_RUNS", "500"))
+
+slow_log = logging.getLogger("tracker.slow_query")
+runs = deque(maxlen=PROFILE_RUNS)
+slow_queries = deque(maxlen=PROFILE_RUNS)
+_local = threading.local()
+
+
+class Run:
+    def __init__(self, page, user):
+        self.page = page
+        self.user = user
+        self.started = time.time()
+        self.total_ms = None
+        self.sections = []   # [name, ms]
+        self.queries = []    # [sql, ms, rows]
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._t0 = time.perf_counter()
+        self._section_t0 = self._t0
+
+    def section(self, name):
+        now = time.perf_counter()
+        if self.sections:
+            self.sections[-1][1] = (now - self._section_t0) * 1000
+        self.sections.append([name, None])
+        self._section_t0 = now
+
+    def finish(self):
+        now = time.perf_counter()
+        if self.sections:
+            self.sections[-1][1] = (now - self._section_t0) * 1000
+        self.total_ms = (now - self._t0) * 1000
+
+
+def current():
+    return getattr(_local, "run", None)
+
+
+def start_run(page, user=None):
+    # A rerun cut short (st.rerun / st.stop) never reaches finish_run; its
+    # run stays listed with total_ms None and is left out of the timings
+    if not PROFILE_ENABLED:
+        return None
+    run = Run(page, user)
+    run.section(page)
+    _local.run = run
+    runs.append(run)
+    return run
+
+
+def section(name):
+    run = current()
+    if run is not None:
+        run.section(name)
+
+
+def finish_run():
+    run = current()
+    if run is not None:
+        run.finish()
+        _local.run = None
+    return run
+
+
+def count_cache(hit):
+    run = current()
+    if run is not None:
+        if hit:
+            run.cache_hits += 1
+        else:
+            run.cache_misses += 1
+
+
+def _slow(rec):
+    run = current()
+    entry = {"at": time.time(), "page": run and run.page, "user": run and run.user,
+             "ms": rec[1], "rows": rec[2], "sql": normalize(rec[0])}
+    slow_queries.append(entry)
+    slow_log.warning("%.1f ms, %d rows: %s", entry["ms"], entry["rows"], entry["sql"])
+
+
+def normalize(sql):
+    # one line, and IN lists of any length look the same
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return re.sub(r"\(\?(?:, ?\?)+\)", "(?, ...)", sql)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    # Duration covers execute plus every fetch; the statement is complete
+    # (and checked against the slow-query threshold) once its rows run out,
+    # the cursor is reused, or the cursor is dropped
+    _rec = None
+
+    def __del__(self):
+        self._end()
+
+    def _begin(self, sql, t0):
+        self._end()
+        self._rec = [sql, (time.perf_counter() - t0) * 1000, 0]
+        run = current()
+        if run is not None:
+            run.queries.append(self._rec)
+        if self.description is None:
+            self._rec[2] = max(self.rowcount, 0)
+            self._end()
+
+    def _fetched(self, t0, rows, done):
+        rec = self._rec
+        if rec is not None:
+            rec[1] += (time.perf_counter() - t0) * 1000
+            rec[2] += rows
+            if done:
+                self._end()
+
+    def _end(self):
+        rec, self._rec = self._rec, None
+        if rec is not None and rec[1] >= SLOW_QUERY_MS:
+            _slow(rec)
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        super().execute(sql, parameters)
+        self._begin(sql, t0)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._begin(sql, t0)
+        return self
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        t0 = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(t0, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows), True)
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(t0, 0, True)
+            raise
+        self._fetched(t0, 1, False)
+        return row
+
+
+# ───────────────────────────────────────────────
+# Summaries for the Diagnostics page
+# ───────────────────────────────────────────────
+def _percentiles(df, by, col, count="runs"):
+    return (df.groupby(by)[col]
+              .agg(**{count: "count"}, p50=lambda s: s.quantile(0.5), p95=lambda s: s.quantile(0.95), max="max")
+              .sort_values("p95", ascending=False)
+              .reset_index())
+
+
+def page_stats():
+    import pandas as pd
+    done = [r for r in list(runs) if r.total_ms is not None]
+    df = pd.DataFrame({"page": [r.page for r in done], "ms": [r.total_ms for r in done],
+                       "queries": [len(r.queries) for r in done]})
+    stats = _percentiles(df, "page", "ms")
+    return stats.merge(df.groupby("page", as_index=False)["queries"].mean(), on="page")
+
+
+def section_stats():
+    import pandas as pd
+    rows = [(r.page, name, ms) for r in list(runs) if r.total_ms is not None for name, ms in r.sections]
+    return _percentiles(pd.DataFrame(rows, columns=["page", "section", "ms"]), ["page", "section"], "ms")
+
+
+def query_stats():
+    import pandas as pd
+    rows = [(normalize(sql), ms, n) for r in list(runs) for sql, ms, n in list(r.queries)]
+    df = pd.DataFrame(rows, columns=["sql", "ms", "rows"])
+    stats = _percentiles(df, "sql", "ms", count="calls")
+    return stats.merge(df.groupby("sql", as_index=False)["rows"].mean(), on="sql")
+
+
+def cache_stats():
+    snapshot = list(runs)
+    return sum(r.cache_hits for r in snapshot), sum(r.cache_misses for r in snapshot)
@@ -0,0 +1,217 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from money import BASE_CURRENCY, convert, load_rates, month_end, to_major
+
+
+# ───────────────────────────────────────────────
+# Dashboard
+# ───────────────────────────────────────────────
+def dashboard_totals(conn, email, to_currency=BASE_CURRENCY):
+    # Lifetime (income, expenses) from the running balances: one row per
+    # currency. Amounts already in to_currency come from the lifetime row;
+    # other currencies are summed month by month at each month's closing
+    # rate, as everywhere else.
+    rows = conn.execute("""
+        SELECT period, currency, income_minor, expense_minor FROM balances
+        WHERE user_email = ? AND ((currency = ? AND period = 'all') OR (currency != ? AND period != 'all'))
+    """, (email, to_currency, to_currency)).fetchall()
+    return _balance_totals(conn, rows, to_currency)
+
+
+def month_totals(conn, email, month, to_currency=BASE_CURRENCY):
+    # (income, expenses) of one month from the running balances
+    rows = conn.execute(
+        "SELECT period, currency, income_minor, expense_minor FROM balances WHERE user_email = ? AND period = ?",
+        (email, month)).fetchall()
+    return _balance_totals(conn, rows, to_currency)
+
+
+def _balance_totals(conn, rows, to_currency):
+    # Rows (period, currency, income_minor, expense_minor) -> (income, expenses);
+    # the rate table is only loaded when some row needs converting
+    same = [r for r in rows if r[1] == to_currency]
+    income = float(to_major(sum(r[2] for r in same)))
+    expenses = float(to_major(sum(r[3] for r in same)))
+    other = [r for r in rows if r[1] != to_currency]
+    if other:
+        rates = load_rates(conn)
+        periods, currencies, inc, exp = zip(*other)
+        dates = month_end(periods)
+        income += float(convert(rates, inc, currencies, dates, to_currency).sum())
+        expenses += float(convert(rates, exp, currencies, dates, to_currency).sum())
+    return income, expenses
+
+
+def budget_progress(conn, email, month, to_currency=BASE_CURRENCY):
+    # Spent vs budget for every budgeted category of the month in one query.
+    # Budgets and spending may be in different currencies, so both sides are
+    # converted at the month's closing rate before comparing.
+    df = pd.read_sql_query("""
+        SELECT category, 'budget' AS part, currency, amount_minor AS minor
+        FROM category_budgets WHERE user_email = ? AND month_year = ?
+        UNION ALL
+        SELECT r.category, 'spent', r.currency, SUM(r.total_minor)
+        FROM expense_rollup r
+        JOIN category_budgets b
+            ON b.user_email = r.user_email AND b.month_year = r.month AND b.category = r.category
+        WHERE r.user_email = ? AND r.month = ?
+        GROUP BY r.category, r.currency
+    """, conn, params=(email, month, email, month))
+    df['value'] = convert(load_rates(conn), df['minor'], df['currency'],
+                          month_end(np.full(len(df), month)), to_currency)
+    df = (df.pivot_table(index='category', columns='part', values='value', aggfunc='sum', fill_value=0)
+            .reindex(columns=['budget', 'spent'], fill_value=0)
+            .reset_index()
+            .rename_axis(columns=None)
+            .sort_values('category', ignore_index=True))
+
+    has_budget = df['budget'] > 0
+    df['remaining'] = df['budget'] - df['spent']
+    df['pct_used'] = (df['spent'] / df['budget'].where(has_budget) * 100).fillna(0)
+    df['pct_under'] = np.where(has_budget, 100 - df['pct_used'], 0)
+    df['level'] = np.select(
+        [~has_budget, df['pct_used'] > 100, df['pct_used'] > 80],
+        ["none", "over", "warning"],
+        default="ok",
+    )
+    return df
+
+
+# ───────────────────────────────────────────────
+# Charts / Prediction
+# ───────────────────────────────────────────────
+def _converted(conn, df, dates, to_currency):
+    df['amount'] = convert(load_rates(conn), df.pop('minor'), df.pop('currency'), dates, to_currency)
+    return df
+
+
+def expenses_by_category(conn, email, since_month=None, to_currency=BASE_CURRENCY, until_month=None):
+    df = pd.read_sql_query(
+        """SELECT category, month, currency, SUM(total_minor) AS minor FROM expense_rollup
+           WHERE user_email = ? AND month >= ? AND month <= ? GROUP BY category, month, currency""",
+        conn, params=(email, since_month or "", until_month or "9999"))
+    df = _converted(conn, df, month_end(df['month']), to_currency)
+    return df.groupby('category', as_index=False)['amount'].sum()
+
+
+def expenses_by_month(conn, email, since_month=None, to_currency=BASE_CURRENCY):
+    df = pd.read_sql_query(
+        """SELECT month, currency, SUM(total_minor) AS minor FROM expense_rollup
+           WHERE user_email = ? AND month >= ? GROUP BY month, currency""",
+        conn, params=(email, since_month or ""))
+    df = _converted(conn, df, month_end(df['month']), to_currency)
+    return df.groupby('month', as_index=False)['amount'].sum().sort_values('month', ignore_index=True)
+
+
+def expenses_by_day(conn, email, since=None, to_currency=BASE_CURRENCY):
+    df = pd.read_sql_query(
+        """SELECT date, currency, SUM(amount_minor) AS minor FROM expenses
+           WHERE user_email = ? AND deleted_at IS NULL AND date >= ?
+           GROUP BY date, currency""",
+        conn, params=(email, since or ""))
+    df['date'] = pd.to_datetime(df['date'])
+    df = _converted(conn, df, df['date'].to_numpy(dtype="datetime64[D]"), to_currency)
+    return df.groupby('date', as_index=False)['amount'].sum().sort_values('date', ignore_index=True)
+
+
+# ───────────────────────────────────────────────
+# Manage Entries
+# ───────────────────────────────────────────────
+ENTRY_TABLES = {
+    # table -> listed columns, live-row filter, entries_fts rowid tag
+    "expenses": ("id, date, category, amount_minor, currency, description, receipt_path", "deleted_at IS NULL", 0),
+    "incomes": ("id, date, source, amount_minor, currency, description", "1", 1),
+}
+SORT_COLUMNS = ("date", "amount_minor", "rank")
+
+
+def fts_query(email, text):
+    # "rent jan" -> this user's entries whose description/category/source
+    # has words starting with "rent" and "jan"
+    terms = re.findall(r"\w+", text or "")
+    if not terms:
+        return None
+    owner = "u" + email.encode().hex()
+    return f"owner:{owner} AND {{description label}}: (" + " AND ".join(f'"{t}"*' for t in terms) + ")"
+
+
+def _entry_filter(table, email, search=None, from_d=None, to_d=None):
+    _, live, tag = ENTRY_TABLES[table]
+    where = ["user_email = ?", live]
+    params = [email]
+    match = fts_query(email, search)
+    if match:
+        where.append("id IN (SELECT rowid / 2 FROM entries_fts WHERE entries_fts MATCH ? AND rowid % 2 = ?)")
+        params += [match, tag]
+    if from_d:
+        where.append("date >= ?")
+        params.append(from_d)
+    if to_d:
+        where.append("date <= ?")
+        params.append(to_d)
+    return " AND ".join(where), params
+
+
+def entries_page(conn, table, email, search=None, from_d=None, to_d=None,
+                 sort="date", descending=True, after=None, page_size=50):
+    # One page ordered by (sort, id); `after` is the cursor returned for the
+    # previous page. Returns (df, cursor for the next page or None).
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"can't sort by {sort}")
+    if sort == "rank":
+        if fts_query(email, search):
+            return _ranked_page(conn, table, email, search, from_d, to_d, after or 0, page_size)
+        sort, descending = "date", True
+    cols = ENTRY_TABLES[table][0]
+    where, params = _entry_filter(table, email, search, from_d, to_d)
+    op, direction = ("<", "DESC") if descending else (">", "ASC")
+    if after is not None:
+        where += f" AND ({sort}, id) {op} (?, ?)"
+        params += list(after)
+
+    df = pd.read_sql_query(
+        f"SELECT {cols} FROM {table} WHERE {where} ORDER BY {sort} {direction}, id {direction} LIMIT ?",
+        conn, params=params + [page_size + 1])
+    if len(df) <= page_size:
+        return df, None
+    df = df.iloc[:page_size]
+    last = df.iloc[-1]
+    return df, (last[sort].item() if hasattr(last[sort], "item") else last[sort], int(last['id']))
+
+
+def _ranked_page(conn, table, email, search, from_d, to_d, offset, page_size):
+    # Best matches first (bm25, description weighted over category/source);
+    # the cursor is an offset since rank isn't a stored column
+    cols, live, tag = ENTRY_TABLES[table]
+    where = ["t.user_email = ?", f"t.{live}" if live != "1" else "1"]
+    params = [fts_query(email, search), tag, email]
+    if from_d:
+        where.append("t.date >= ?")
+        params.append(from_d)
+    if to_d:
+        where.append("t.date <= ?")
+        params.append(to_d)
+    t_cols = ", ".join(f"t.{c.strip()}" for c in cols.split(","))
+    df = pd.read_sql_query(f"""
+        SELECT {t_cols} FROM entries_fts f
+        JOIN {table} t ON t.id = f.rowid / 2
+        WHERE entries_fts MATCH ? AND f.rowid % 2 = ? AND {" AND ".join(where)}
+        ORDER BY bm25(entries_fts, 2.0, 1.0, 0.0)
+        LIMIT ? OFFSET ?
+    """, conn, params=params + [page_size + 1, offset])
+    if len(df) <= page_size:
+        return df, None
+    return df.iloc[:page_size], offset + page_size
+
+
+# ───────────────────────────────────────────────
+# Trash
+# ───────────────────────────────────────────────
+def trash_entries(conn, email):
+    return pd.read_sql_query(
+        """SELECT id, date, category, amount_minor / 100.0 AS amount, currency, description FROM expenses
+           WHERE user_email = ? AND deleted_at IS NOT NULL ORDER BY deleted_at DESC""",
+        conn, params=(email,))
@@ -0,0 +1,78 @@
+# Content-addressed receipt store.
+#
+# A receipt lives at <root>/ab/cd/<sha256><ext>: identical uploads share one
+# file and nothing is ever overwritten by a later upload with the same name.
+# Previews use downscaled JPEG thumbnails generated once under <root>/thumbs.
+import hashlib
+import os
+import tempfile
+
+RECEIPTS_DIR = os.environ.get("TRACKER_RECEIPTS_DIR", "receipts")
+CHUNK_BYTES = 1024 * 1024
+THUMB_WIDTH = 400
+
+
+def store_receipt(fileobj, filename, root=RECEIPTS_DIR):
+    # Stream the upload to a temp file while hashing it, then move it into
+    # place (or drop it if that content is already stored). Returns the path.
+    ext = os.path.splitext(filename)[1].lower() or ".bin"
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if hasattr(fileobj, "seek"):
+                fileobj.seek(0)
+            while chunk := fileobj.read(CHUNK_BYTES):
+                digest.update(chunk)
+                out.write(chunk)
+        h = digest.hexdigest()
+        path = os.path.join(root, h[:2], h[2:4], h + ext)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        return path
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _thumb_path(path, width, root):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if len(stem) != 64:
+        # pre-content-addressed receipt (receipts/<email>_<name>)
+        stem = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(root, "thumbs", str(width), stem[:2], f"{stem}.jpg")
+
+
+def thumbnail(path, width=THUMB_WIDTH, root=RECEIPTS_DIR):
+    # Cached downscaled JPEG of a receipt; falls back to the original if it
+    # can't be decoded (or Pillow is missing)
+    thumb = _thumb_path(path, width, root)
+    if os.path.exists(thumb):
+        return thumb
+    try:
+        from PIL import Image
+        with Image.open(path) as im:
+            im.thumbnail((width, width * 4))
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(thumb), prefix=".thumb-")
+            with os.fdopen(fd, "wb") as out:
+                im.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+            os.replace(tmp, thumb)
+        return thumb
+    except (ImportError, OSError):
+        return path
+
+
+def remove_thumbnails(path, root=RECEIPTS_DIR):
+    thumbs = os.path.join(root, "thumbs")
+    if not os.path.isdir(thumbs):
+        return
+    for width in os.listdir(thumbs):
+        thumb = _thumb_path(path, width, root)
+        if os.path.exists(thumb):
+            os.remove(thumb)
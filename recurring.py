@@ -0,0 +1,67 @@
+# Recurring transactions engine.
+#
+# A recurring expense/income is a template row (is_recurring = 1) whose
+# next_date is the next occurrence due. run_recurring() materialises every
+# occurrence that is due for all users in one transaction and advances the
+# template's next_date, so running it twice never duplicates anything.
+import calendar
+from datetime import date, timedelta
+
+FREQUENCIES = ["Monthly", "Weekly"]
+
+_TABLES = {
+    # table -> (columns copied onto each occurrence, extra filter for live templates)
+    "expenses": (("user_email", "category", "amount_minor", "currency", "description"), "AND deleted_at IS NULL"),
+    "incomes": (("user_email", "source", "amount_minor", "currency", "description"), ""),
+}
+
+
+def _add_months(d, months, day):
+    # Same day-of-month as the template, clamped to short months
+    # (Jan 31 -> Feb 28 -> Mar 31, no drift)
+    y, m = divmod(d.month - 1 + months, 12)
+    y, m = d.year + y, m + 1
+    return date(y, m, min(day, calendar.monthrange(y, m)[1]))
+
+
+def next_occurrence(d, frequency, anchor_day=None):
+    if frequency == "Weekly":
+        return d + timedelta(days=7)
+    return _add_months(d, 1, anchor_day or d.day)
+
+
+def _parse(value):
+    return date.fromisoformat(value[:10])
+
+
+def run_recurring(conn, today=None):
+    today = today or date.today()
+    added = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, (copy_cols, live) in _TABLES.items():
+            cols = ", ".join(copy_cols)
+            due = conn.execute(f"""
+                SELECT id, date, next_date, frequency, {cols} FROM {table}
+                WHERE is_recurring = 1 AND next_date <= ? {live}
+            """, (today.isoformat(),)).fetchall()
+
+            occurrences, advances = [], []
+            for row in due:
+                tid, first, nd, freq, values = row[0], row[1], _parse(row[2]), row[3], row[4:]
+                anchor_day = _parse(first).day if first else nd.day
+                while nd <= today:
+                    occurrences.append((nd.isoformat(),) + tuple(values))
+                    nd = next_occurrence(nd, freq, anchor_day)
+                advances.append((nd.isoformat(), tid))
+
+            conn.executemany(
+                f"INSERT INTO {table} (date, {cols}) VALUES ({', '.join('?' * (len(copy_cols) + 1))})",
+                occurrences)
+            conn.executemany(f"UPDATE {table} SET next_date = ? WHERE id = ?", advances)
+            added[table] = len(occurrences)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return added
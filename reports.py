@@ -0,0 +1,141 @@
+# Headless monthly statements for every user.
+#
+# Users are split into batches and handed to a process pool; each worker
+# process opens its own read-only connections (one per database shard, see
+# db.py) and builds reports with the same queries the Dashboard uses
+# (queries.py). Output:
+#   OUT/<month>/<user>.csv|.html   per-user statement
+#   OUT/<month>/summary.json       run totals and throughput
+import html
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+import db
+import queries
+from money import BASE_CURRENCY
+
+REPORT_SHARD_USERS = int(os.environ.get("TRACKER_REPORT_SHARD_USERS", "200"))
+
+_path = None
+_conns = {}
+
+
+def open_readonly(path):
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True,
+                           check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute("PRAGMA cache_size = -16384")
+    return conn
+
+
+def _init_worker(path):
+    global _path
+    _path = path
+
+
+def _conn_for(email):
+    shard = db.shard_path(email, _path)
+    if shard not in _conns:
+        _conns[shard] = open_readonly(shard)
+    return _conns[shard]
+
+
+def _filename(email):
+    return re.sub(r"[^A-Za-z0-9@._-]", "_", email)
+
+
+def user_report(conn, email, month, currency=BASE_CURRENCY):
+    # -> (summary dict, per-category DataFrame) for one user and month
+    income, expenses = queries.month_totals(conn, email, month, currency)
+    lifetime_income, lifetime_expenses = queries.dashboard_totals(conn, email, currency)
+    spent = queries.expenses_by_category(conn, email, month, currency, until_month=month)
+    budgets = queries.budget_progress(conn, email, month, currency)
+
+    table = (spent.rename(columns={'amount': 'spent'})
+                  .merge(budgets.drop(columns=['spent', 'pct_under']), on='category', how='outer')
+                  .sort_values('category', ignore_index=True))
+    table['spent'] = table['spent'].fillna(0)
+    table['level'] = table['level'].fillna("none")
+    summary = {
+        "user": email, "month": month, "currency": currency,
+        "income": income, "expenses": expenses, "savings": income - expenses,
+        "lifetime_savings": lifetime_income - lifetime_expenses,
+        "over_budget": int((table['level'] == "over").sum()),
+    }
+    return summary, table
+
+
+def _write_html(path, summary, table):
+    cur = html.escape(summary["currency"])
+    rows = "".join(f"<tr><th>{k}</th><td>{summary[k]:,.2f} {cur}</td></tr>"
+                   for k in ("income", "expenses", "savings", "lifetime_savings"))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"<!doctype html><meta charset='utf-8'><title>Statement {summary['month']}</title>"
+                f"<h1>Statement for {html.escape(summary['user'])}, {summary['month']}</h1>"
+                f"<table>{rows}</table><h2>By category</h2>"
+                + table.to_html(index=False, float_format=lambda v: f"{v:,.2f}", na_rep=""))
+
+
+def _report_shard(emails, month, out_dir, formats, currency):
+    t0 = time.perf_counter()
+    stats = {"users": 0, "files": 0, "over_budget_users": 0, "income": 0.0, "expenses": 0.0, "errors": []}
+    for email in emails:
+        try:
+            summary, table = user_report(_conn_for(email), email, month, currency)
+            base = os.path.join(out_dir, _filename(email))
+            if "csv" in formats:
+                table.to_csv(base + ".csv", index=False, float_format="%.2f")
+                stats["files"] += 1
+            if "html" in formats:
+                _write_html(base + ".html", summary, table)
+                stats["files"] += 1
+        except Exception as e:
+            stats["errors"].append(f"{email}: {e}")
+            continue
+        stats["users"] += 1
+        stats["over_budget_users"] += summary["over_budget"] > 0
+        stats["income"] += summary["income"]
+        stats["expenses"] += summary["expenses"]
+    stats["seconds"] = time.perf_counter() - t0
+    return stats
+
+
+def run_reports(path, month, out_root, workers=None, formats=("csv", "html"), currency=BASE_CURRENCY,
+                shard_users=REPORT_SHARD_USERS, progress=None):
+    # Reports for every user; returns the run summary
+    t0 = time.perf_counter()
+    out_dir = os.path.join(out_root, month)
+    os.makedirs(out_dir, exist_ok=True)
+    conn = open_readonly(path)
+    emails = [r[0] for r in conn.execute("SELECT email FROM users ORDER BY email")]
+    conn.close()
+    workers = workers or os.cpu_count() or 1
+    # small runs still spread over every worker
+    shard_users = max(1, min(shard_users, -(-len(emails) // (workers * 4))))
+    shards = [emails[i:i + shard_users] for i in range(0, len(emails), shard_users)]
+
+    total = {"users": 0, "files": 0, "over_budget_users": 0, "income": 0.0, "expenses": 0.0, "errors": []}
+    worker_seconds = 0.0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as pool:
+        futures = [pool.submit(_report_shard, shard, month, out_dir, formats, currency) for shard in shards]
+        for future in futures:
+            stats = future.result()
+            worker_seconds += stats.pop("seconds")
+            for key, value in stats.items():
+                total[key] += value
+            if progress:
+                progress(total["users"] + len(total["errors"]), len(emails))
+
+    elapsed = time.perf_counter() - t0
+    summary = dict(total, month=month, currency=currency, shards=len(shards),
+                   workers=workers, seconds=elapsed,
+                   users_per_sec=total["users"] / elapsed if elapsed > 0 else 0.0,
+                   worker_seconds=worker_seconds)
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
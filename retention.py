@@ -0,0 +1,113 @@
+# Trash retention and space reclamation.
+#
+# Trashed expenses older than TRACKER_TRASH_DAYS are deleted in batches (one
+# short write transaction each, so the app's writers aren't held up), and
+# receipt files no other row points at go with them. Freed pages are handed
+# back to the filesystem a bounded number at a time with incremental_vacuum
+# (the database has auto_vacuum = INCREMENTAL, see db.py).
+import os
+from datetime import datetime, timedelta
+
+import db
+from receipts import RECEIPTS_DIR, remove_thumbnails
+
+TRASH_RETENTION_DAYS = float(os.environ.get("TRACKER_TRASH_DAYS", "30"))
+PURGE_BATCH_ROWS = int(os.environ.get("TRACKER_PURGE_BATCH_ROWS", "1000"))
+VACUUM_STEP_PAGES = int(os.environ.get("TRACKER_VACUUM_PAGES", "2000"))
+
+
+def _delete_rows(conn, ids):
+    # Deletes expenses by id inside the caller's transaction; returns the
+    # receipt files no remaining row references
+    marks = ", ".join("?" * len(ids))
+    paths = {r[0] for r in conn.execute(
+        f"SELECT DISTINCT receipt_path FROM expenses WHERE id IN ({marks}) AND receipt_path IS NOT NULL", ids)}
+    conn.execute(f"DELETE FROM expenses WHERE id IN ({marks})", ids)
+    # identical uploads share one file (receipts.py), so only drop unreferenced ones
+    return [p for p in paths
+            if conn.execute("SELECT 1 FROM expenses WHERE receipt_path = ? LIMIT 1", (p,)).fetchone() is None]
+
+
+def _unreferenced(paths, db_path=None):
+    # One receipt file can be shared by users on different shards, so a
+    # file goes only if no shard's rows point at it any more
+    for shard in db.shard_paths(db_path):
+        if not paths:
+            break
+        with db.connection(shard) as conn:
+            paths = [p for p in paths
+                     if conn.execute("SELECT 1 FROM expenses WHERE receipt_path = ? LIMIT 1", (p,)).fetchone() is None]
+    return paths
+
+
+def _remove_files(paths, root):
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        remove_thumbnails(path, root)
+    return removed
+
+
+def delete_trashed(conn, email, ids, root=RECEIPTS_DIR, db_path=None, batch_rows=PURGE_BATCH_ROWS):
+    # "Permanent Delete" from the Trash page: only this user's trashed rows,
+    # all in one transaction. Ids go in batches to keep each IN list well
+    # under SQLite's bound-variable limit when a whole trash is emptied.
+    ids = [int(i) for i in ids]
+    deleted = 0
+    orphans = set()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for start in range(0, len(ids), batch_rows):
+            batch = ids[start:start + batch_rows]
+            marks = ", ".join("?" * len(batch))
+            own = [r[0] for r in conn.execute(
+                f"SELECT id FROM expenses WHERE user_email = ? AND deleted_at IS NOT NULL AND id IN ({marks})",
+                [email] + batch)]
+            if own:
+                orphans.update(_delete_rows(conn, own))
+            deleted += len(own)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    # files go only once the rows are gone for good
+    _remove_files(_unreferenced(sorted(orphans), db_path), root)
+    return deleted
+
+
+def purge_trash(conn, days=TRASH_RETENTION_DAYS, now=None, batch_rows=PURGE_BATCH_ROWS, root=RECEIPTS_DIR,
+                db_path=None):
+    # Delete trash older than `days` for every user; returns counts
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+    purged = files = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [r[0] for r in conn.execute(
+                "SELECT id FROM expenses WHERE deleted_at IS NOT NULL AND deleted_at < ? LIMIT ?",
+                (cutoff, batch_rows))]
+            orphans = _delete_rows(conn, ids) if ids else []
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        # files go only once the rows are gone for good
+        files += _remove_files(_unreferenced(orphans, db_path), root)
+        purged += len(ids)
+        if len(ids) < batch_rows:
+            return {"rows": purged, "receipts": files}
+
+
+def vacuum_step(conn, pages=VACUUM_STEP_PAGES):
+    # Return up to `pages` free pages to the filesystem; -> pages freed
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if free:
+        # executescript steps the pragma to completion; execute() frees one page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
@@ -0,0 +1,149 @@
+# Deterministic synthetic data for load testing.
+#
+# Fills a database with users, expenses, incomes, budgets, recurring
+# templates and exchange rates. The same seed, counts and end date always
+# produce the same rows, so benchmark runs are comparable. Rows go in through
+# the normal triggers (rollups, versions, full-text index), batch by batch.
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+
+SEED_DOMAIN = "seed.example"
+SEED_PASSWORD = "password"
+SEED_BATCH_USERS = 100
+
+# (description, category) - descriptions reuse words the import rules know
+MERCHANTS = [
+    ("Swiggy order", "Food"), ("Zomato order", "Food"), ("Grocery supermarket", "Food"),
+    ("Coffee cafe", "Food"), ("Restaurant dinner", "Food"),
+    ("Uber trip", "Transport"), ("Ola ride", "Transport"), ("Fuel petrol", "Transport"),
+    ("Metro card", "Transport"), ("Parking", "Transport"),
+    ("Electric bill", "Rent/Bills"), ("Internet broadband", "Rent/Bills"), ("Mobile recharge", "Rent/Bills"),
+    ("Insurance premium", "Rent/Bills"),
+    ("Netflix", "Entertainment"), ("Spotify", "Entertainment"), ("Movie tickets", "Entertainment"),
+    ("Concert", "Entertainment"),
+    ("Amazon", "Shopping"), ("Flipkart", "Shopping"), ("Myntra", "Shopping"), ("Mall store", "Shopping"),
+    ("Pharmacy", "Other"), ("Gift for friend", "Other"), ("Donation", "Other"),
+]
+# typical amount per category in rupees (log-normal around it)
+TYPICAL = {"Food": 400, "Transport": 250, "Rent/Bills": 1500, "Entertainment": 500, "Shopping": 1800, "Other": 700}
+CITIES = ["Delhi", "Mumbai", "Bengaluru", "Pune", "Jaipur", "Chennai", "Kolkata", "Hyderabad"]
+FOREIGN = {"USD": 83.0, "EUR": 90.0}
+
+
+def _rates(rng, month_starts):
+    # Monthly random-walk rates for the foreign currencies
+    rows = []
+    for cur, base in FOREIGN.items():
+        walk = base * np.exp(np.cumsum(rng.normal(0, 0.01, len(month_starts))))
+        rows += [(cur, m.isoformat(), round(float(r), 4)) for m, r in zip(month_starts, walk)]
+    return rows
+
+
+def _expenses(rng, emails, per_user, start, days):
+    n = rng.poisson(per_user, len(emails))
+    total = int(n.sum())
+    owner = np.repeat(emails, n)
+    dates = (np.datetime64(start) + rng.integers(0, days, total)).astype(str)
+    pick = rng.integers(0, len(MERCHANTS), total)
+    desc = np.array([m for m, _ in MERCHANTS], dtype=object)[pick]
+    cats = np.array([c for _, c in MERCHANTS], dtype=object)[pick]
+    typical = np.array([TYPICAL[c] for _, c in MERCHANTS])[pick]
+    minor = np.maximum(np.round(typical * rng.lognormal(0, 0.6, total) * 100), 100).astype(np.int64)
+    foreign = rng.random(total) < 0.05
+    currency = np.where(foreign, "USD", "INR").astype(object)
+    minor = np.where(foreign, minor // 80, minor)
+    desc = desc + " " + np.array(CITIES, dtype=object)[rng.integers(0, len(CITIES), total)]
+    return zip(owner.tolist(), dates.tolist(), cats.tolist(), minor.tolist(), currency.tolist(), desc.tolist())
+
+
+def _insert_by_shard(path, emails, tables):
+    # tables: [(sql, rows)] with the user's email first in every row; one
+    # transaction per shard
+    shard = {e: db.shard_path(e, path) for e in emails}
+    for p in dict.fromkeys(shard.values()):
+        with db.connection(p) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, rows in tables:
+                    conn.executemany(sql, [r for r in rows if shard[r[0]] == p])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+
+def generate(path=None, users=1000, expenses_per_user=1000, months=36, end=None, seed=0,
+             batch_users=SEED_BATCH_USERS, progress=None):
+    # Adds `users` users (user000000@seed.example ...) with about
+    # expenses_per_user expenses each over `months` months ending at `end`.
+    # Users go to the catalog, their rows to their shards (see db.py).
+    # Returns dict of row counts.
+    end = end or date.today()
+    last = end.year * 12 + end.month - 1
+    month_starts = [date(m // 12, m % 12 + 1, 1) for m in range(last - months + 1, last + 1)]
+    start = month_starts[0]
+    days = (end - start).days + 1
+    rng = np.random.default_rng(seed)
+
+    try:
+        import bcrypt
+        pw_hash = bcrypt.hashpw(SEED_PASSWORD.encode(), bcrypt.gensalt()).decode()
+    except ImportError:
+        pw_hash = ""
+
+    counts = {"users": 0, "expenses": 0, "incomes": 0, "budgets": 0}
+    rates = _rates(rng, month_starts)
+    for p in db.all_paths(path):
+        with db.connection(p) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO fx_rates VALUES (?, ?, ?)", rates)
+            conn.commit()
+
+    for first in range(0, users, batch_users):
+        emails = [f"user{i:06d}@{SEED_DOMAIN}" for i in range(first, min(first + batch_users, users))]
+        with db.connection(path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR IGNORE INTO users (email, name, password_hash) VALUES (?, ?, ?)",
+                             [(e, f"User {e[4:10]}", pw_hash) for e in emails])
+            conn.commit()
+
+        expenses = list(_expenses(rng, np.array(emails, dtype=object), expenses_per_user, start, days))
+
+        # monthly salary plus the odd freelance payment
+        salary = (rng.integers(300, 1500, len(emails)) * 10000).tolist()
+        incomes = [(e, m.isoformat(), "Salary", s, "INR", "Salary payroll")
+                   for e, s in zip(emails, salary) for m in month_starts]
+        extra = rng.poisson(months / 6, len(emails))
+        for e, k in zip(emails, extra.tolist()):
+            offsets = rng.integers(0, days, k).tolist()
+            amounts = (rng.integers(50, 2000, k) * 1000).tolist()
+            incomes += [(e, (start + timedelta(days=o)).isoformat(), "Freelance", a, "INR", "Freelance invoice")
+                        for o, a in zip(offsets, amounts)]
+
+        # budgets for the last three months, rent as a recurring template
+        recent = [m.strftime("%Y-%m") for m in month_starts[-3:]]
+        budgets = [(e, m, c, int(TYPICAL[c] * expenses_per_user / months * 100 * rng.uniform(0.8, 1.3)))
+                   for e in emails for m in recent for c in TYPICAL]
+        next_rent = date((last + 1) // 12, (last + 1) % 12 + 1, 1).isoformat()
+        rent = [(e, start.isoformat(), s // 3, next_rent) for e, s in zip(emails, salary)]
+
+        _insert_by_shard(path, emails, [
+            ("INSERT INTO expenses (user_email, date, category, amount_minor, currency, description) "
+             "VALUES (?, ?, ?, ?, ?, ?)", expenses),
+            ("INSERT INTO incomes (user_email, date, source, amount_minor, currency, description) "
+             "VALUES (?, ?, ?, ?, ?, ?)", incomes),
+            ("INSERT OR REPLACE INTO category_budgets (user_email, month_year, category, amount_minor) "
+             "VALUES (?, ?, ?, ?)", budgets),
+            ("INSERT INTO expenses (user_email, date, category, amount_minor, description, is_recurring, frequency, next_date) "
+             "VALUES (?, ?, 'Rent/Bills', ?, 'Rent', 1, 'Monthly', ?)", rent),
+        ])
+        counts["expenses"] += len(expenses)
+        counts["incomes"] += len(incomes)
+        counts["budgets"] += len(budgets)
+        counts["users"] += len(emails)
+        if progress:
+            progress(counts["users"], users)
+    return counts
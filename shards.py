@@ -0,0 +1,117 @@
+# Splitting per-user data into shard files (routing lives in db.py).
+#
+# Copies every user's rows from the current layout - the single tracker.db,
+# or the shards of the current TRACKER_SHARDS - into the files for a new
+# shard count, checks the row counts, and only then clears the copied rows
+# from the old files. Inserts go through the normal triggers, so rollups and
+# the full-text index fill in as the rows arrive. Run it with the app
+# stopped, then restart with TRACKER_SHARDS set to the new count. If it
+# stops part way, delete the new files and run it again.
+#   python manage.py split-shards --shards 4
+import sqlite3
+
+import db
+
+# Per-user tables, in copy order; data_versions goes last so the copied
+# counters (and the forecasts keyed on them) end up as they were
+USER_TABLES = ["expenses", "incomes", "category_budgets", "sent_alerts", "forecasts", "data_versions"]
+# The '*' row counts fx_rates changes; each file keeps its own
+_USER_ROWS = {"data_versions": "user_email != '*'"}
+
+
+def _open(path, count):
+    conn = sqlite3.connect(path, timeout=db.BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.create_function("shard_of", 1, lambda email: db.shard_index(email, count), deterministic=True)
+    return conn
+
+
+def _columns(conn, table, renumber):
+    # table_info leaves out generated columns (month), which can't be inserted
+    cols = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+    return ", ".join(c for c in cols if not (renumber and c == "id"))
+
+
+def _count(conn, table):
+    where = _USER_ROWS.get(table, "1")
+    return conn.execute(f"SELECT count(*) FROM main.{table} WHERE {where}").fetchone()[0]
+
+
+def split(path=None, count=None, from_count=None, keep=False, progress=None):
+    # Move user data from `from_count` shards (default: TRACKER_SHARDS) to
+    # `count`; returns {table: rows copied}. Raises ValueError if a target
+    # file already holds user rows or the copy comes up short.
+    path = path or db.DB_PATH
+    count = count or db.SHARD_COUNT
+    sources = db.shard_paths(path, from_count)
+    targets = db.shard_paths(path, count)
+    if sources == targets:
+        raise ValueError(f"Data is already in {len(targets)} shard(s)")
+    # Ids are only unique within a file: rows merged from several shards
+    # get new ones (nothing else refers to an entry's id)
+    renumber = len(sources) > 1
+    db.init_db(path, count)
+
+    for target in targets:
+        conn = _open(target, count)
+        try:
+            busy = [t for t in USER_TABLES if _count(conn, t)]
+        finally:
+            conn.close()
+        if busy:
+            raise ValueError(f"{target} already holds user rows ({', '.join(busy)})")
+
+    copied = dict.fromkeys(USER_TABLES, 0)
+    expected = dict.fromkeys(USER_TABLES, 0)
+    for n, source in enumerate(sources):
+        conn = _open(source, count)
+        try:
+            for table in USER_TABLES:
+                expected[table] += _count(conn, table)
+            for i, target in enumerate(targets):
+                conn.execute("ATTACH DATABASE ? AS dst", (target,))
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # rates are global; every file has them all
+                    conn.execute("INSERT OR REPLACE INTO dst.fx_rates SELECT * FROM main.fx_rates")
+                    for table in USER_TABLES:
+                        cols = _columns(conn, table, renumber)
+                        where = _USER_ROWS.get(table, "1")
+                        # OR REPLACE only matters for data_versions, whose
+                        # rows the inserts above have just bumped
+                        cur = conn.execute(f"""INSERT OR REPLACE INTO dst.{table} ({cols})
+                                               SELECT {cols} FROM main.{table}
+                                               WHERE {where} AND shard_of(user_email) = ?""", (i,))
+                        copied[table] += cur.rowcount
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE dst")
+        finally:
+            conn.close()
+        if progress:
+            progress(n + 1, len(sources))
+
+    short = [t for t in USER_TABLES if copied[t] != expected[t]]
+    if short:
+        raise ValueError("Row counts differ after the copy ("
+                         + ", ".join(f"{t}: {copied[t]} of {expected[t]}" for t in short)
+                         + "); old files left as they were")
+
+    if not keep:
+        for source in sources:
+            conn = _open(source, count)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # triggers empty the rollups and the full-text index as rows go
+                for table in USER_TABLES:
+                    conn.execute(f"DELETE FROM {table} WHERE {_USER_ROWS.get(table, '1')}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+    return copied